@@ -0,0 +1,179 @@
+import io
+import threading
+import time
+import wave
+from collections import deque
+
+import pygame
+
+from decoders import AUDIO_CHANNELS, AUDIO_FREQUENCY
+from frame_store import find_audio
+from instrumentation import Instrumentation
+
+
+def wav_image(pcm, frequency=AUDIO_FREQUENCY, channels=AUDIO_CHANNELS):
+    # pygame.mixer.music streams from a file-like object, so the PCM gets a WAV header in front
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(frequency)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def decode_wav(video_path, backend, cancelled=lambda: False, has_audio=None):
+    """Decodes a clip's audio into a WAV image. Returns b'' for a silent clip and None if cancelled."""
+    if has_audio is False:
+        return b''
+    baked = find_audio(video_path)
+    if baked is not None:
+        # bake.py already wrote the PCM, no decoder needed
+        pcm_path, frequency, channels = baked
+        with open(pcm_path, 'rb') as file:
+            return wav_image(file.read(), frequency, channels)
+    pcm = backend.decode_audio(video_path, cancelled, has_audio)
+    if not pcm:
+        return pcm
+    return wav_image(pcm)
+
+
+class AudioPlayer:
+    """Clip audio through pygame.mixer.music, from PCM that one long-lived worker thread decodes ahead of need.
+
+    Stop, seek and cancel take effect immediately. position() comes from the mixer itself, so the video clock can
+    follow the audio that is actually being heard.
+    """
+
+    def __init__(self, cache, backend, instrumentation=None, media_index=None):
+        self.cache = cache
+        self.backend = backend
+        self.media_index = media_index
+        self.instrumentation = instrumentation or Instrumentation()
+        # Without an audio device everything still plays, silently, on the wall clock
+        self.available = pygame.mixer.get_init() is not None
+        self.pending = deque()
+        self.decoding = None
+        self.cancel_decoding = False
+        self.failed = set()
+        self.closed = False
+        self.condition = threading.Condition()
+        self.video_path = None
+        self.offset = 0.0
+        self.duration = 0.0
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                video_path = self.decoding = self.pending.popleft()
+                self.cancel_decoding = False
+
+            decode_started = time.perf_counter()
+            try:
+                has_audio = self.media_index.has_audio(video_path) if self.media_index is not None else None
+                wav = decode_wav(video_path, self.backend, lambda: self.cancel_decoding or self.closed, has_audio)
+            except Exception as e:
+                print(f"Error decoding audio of {video_path}: {e}")
+                wav = None
+                with self.condition:
+                    self.failed.add(video_path)
+            if wav is not None and self.instrumentation.enabled:
+                self.instrumentation.record('audio_decode', time.perf_counter() - decode_started)
+
+            with self.condition:
+                if wav is not None:
+                    self.cache.store(video_path, wav)
+                elif video_path not in self.failed and not self.cancel_decoding and not self.closed:
+                    # Cancelled, but preloaded or requested again before the cancellation took effect
+                    self.pending.appendleft(video_path)
+                self.decoding = None
+                self.condition.notify_all()
+
+    def preload(self, video_paths):
+        """Queues these clips' audio for decoding in order, dropping queued or running decodes of any other clip."""
+        if not self.available:
+            return
+        with self.condition:
+            if self.decoding is not None:
+                # A clip that is wanted again keeps decoding even if an earlier preload cancelled it
+                self.cancel_decoding = self.decoding not in video_paths
+            self.pending = deque(path for path in dict.fromkeys(video_paths) if self.needs_decode(path))
+            self.condition.notify_all()
+
+    def request(self, video_path):
+        # Needed right now: jump the queue
+        if not self.available:
+            return
+        with self.condition:
+            if video_path == self.decoding:
+                self.cancel_decoding = False
+            if not self.needs_decode(video_path):
+                return
+            if video_path in self.pending:
+                self.pending.remove(video_path)
+            self.pending.appendleft(video_path)
+            self.condition.notify_all()
+
+    def needs_decode(self, video_path):
+        return (video_path != self.decoding and video_path not in self.failed
+                and not self.cache.contains(video_path))
+
+    def is_ready(self, video_path):
+        # True once play() can start without waiting, including for clips that have or will have no sound
+        if not self.available or video_path in self.failed:
+            return True
+        return self.cache.contains(video_path)
+
+    def play(self, video_path, start=0.0):
+        """Starts the clip's audio at `start` seconds. Returns False if there is nothing to play."""
+        self.stop()
+        if not self.available:
+            return False
+        wav = self.cache.get(video_path)
+        if not wav:
+            return False
+        with wave.open(io.BytesIO(wav), 'rb') as header:
+            self.duration = header.getnframes() / header.getframerate()
+        pygame.mixer.music.load(io.BytesIO(wav), 'wav')
+        pygame.mixer.music.play(start=start)
+        self.video_path = video_path
+        self.offset = start
+        return True
+
+    def seek(self, position):
+        if self.video_path is not None:
+            pygame.mixer.music.play(start=position)
+            self.offset = position
+
+    def position(self):
+        # Seconds into the clip as far as the mixer has played it, or None when nothing is playing.
+        # get_pos() keeps counting after the music ends, so the end of the track caps it
+        if not self.busy:
+            return None
+        elapsed = pygame.mixer.music.get_pos()
+        if elapsed < 0:
+            return None
+        return min(self.offset + elapsed / 1000, self.duration)
+
+    @property
+    def busy(self):
+        return self.video_path is not None and pygame.mixer.music.get_busy()
+
+    def stop(self):
+        if self.video_path is not None:
+            pygame.mixer.music.stop()
+            pygame.mixer.music.unload()
+            self.video_path = None
+
+    def close(self):
+        self.stop()
+        with self.condition:
+            self.closed = True
+            self.pending.clear()
+            self.condition.notify_all()
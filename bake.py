@@ -0,0 +1,64 @@
+"""Offline bake: pre-transcodes every clip in a story into memory-mapped raw frame stores.
+
+Trades disk for CPU on fixed installations. Playback streams baked clips straight from mmap and falls back to
+moviepy for anything not baked (or baked before the source file last changed):
+
+    python bake.py --nodes nodes.json --resolution 1280x720 --resolution 1920x1080
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from frame_store import BAKE_DIR, BAKE_RESOLUTIONS, bake_clip, find_store, store_dir
+from story import story_media
+from story_store import load_story
+from utils import parse_size
+
+DEFAULT_NODES = 'nodes.json'
+
+
+def is_baked(video_path, size, bake_dir):
+    return find_store(video_path, size, bake_dir) == store_dir(video_path, size, bake_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', default=DEFAULT_NODES, help='story graph whose clips are baked')
+    parser.add_argument('--resolution', action='append', type=parse_size,
+                        help='WIDTHxHEIGHT to bake at, may be repeated (default 1280x720)')
+    parser.add_argument('--output', default=BAKE_DIR, help='directory for the baked stores')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='parallel bake processes')
+    parser.add_argument('--force', action='store_true', help='re-bake clips that are already up to date')
+    args = parser.parse_args()
+    resolutions = args.resolution or BAKE_RESOLUTIONS
+
+    jobs = []
+    video_paths = [path for path, is_video in story_media(load_story(args.nodes)).items() if is_video]
+    for video_path in video_paths:
+        if not os.path.exists(video_path):
+            print(f"Skipping {video_path}: file not found")
+            continue
+        for size in resolutions:
+            if args.force or not is_baked(video_path, size, args.output):
+                jobs.append((video_path, size))
+
+    failed = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(bake_clip, video_path, size, args.output): (video_path, size)
+                   for video_path, size in jobs}
+        for future in as_completed(futures):
+            video_path, (width, height) = futures[future]
+            try:
+                print(f"Baked {video_path} at {width}x{height} into {future.result()}")
+            except Exception as e:
+                failed += 1
+                print(f"Error baking {video_path} at {width}x{height}: {e}")
+    print(f"{len(jobs) - failed} of {len(jobs)} bakes done in {time.perf_counter() - started:.1f}s")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
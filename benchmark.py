@@ -0,0 +1,116 @@
+"""Headless benchmark: plays a scripted choice path through a story and prints machine-readable timings.
+
+Runs with SDL's dummy video and audio drivers, so it works on CI boxes without a display:
+
+    python benchmark.py --nodes assets/example/example_nodes.json --path Video,Picture,Home --output bench.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import sys
+import time
+
+# Must be set before pygame is initialised
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+from decoders import BACKENDS
+from instrumentation import Instrumentation, StageTimings
+from main import Game
+from media_cache import MEMORY_BUDGET_BYTES
+from quality import QUALITY_LEVELS
+
+DEFAULT_NODES = 'assets/example/example_nodes.json'
+DEFAULT_PATH = 'Video,Picture,Home'
+STAGES = ('decode', 'convert', 'scale', 'blit', 'flip', 'tick', 'frame', 'display_media', 'set_game_state')
+
+
+def to_ms(stats):
+    return {key: value if key == 'count' else value * 1000 for key, value in stats.items()}
+
+
+def run_benchmark(node_file, choice_path, timeout, decoder=None, quality=None, memory_budget=MEMORY_BUDGET_BYTES):
+    timings = StageTimings()
+    game = Game(node_file, instrumentation=Instrumentation([timings]), decoder=decoder, quality=quality,
+                memory_budget=memory_budget)
+    latencies = StageTimings()
+    remaining = list(choice_path)
+    pending_choice = None
+    started = time.perf_counter()
+
+    try:
+        while game.game_is_running and time.perf_counter() - started < timeout:
+            game.tick()
+
+            if pending_choice is not None and game.first_frame_shown():
+                latencies.record('choice_to_first_frame', time.perf_counter() - pending_choice)
+                pending_choice = None
+
+            if pending_choice is None and game.awaiting_choice:
+                if not remaining:
+                    break
+                choice_text = remaining.pop(0)
+                if choice_text not in game.current_node.choices:
+                    raise ValueError(f'Choice {choice_text!r} is not offered by node {game.current_node.key!r}')
+                pending_choice = time.perf_counter()
+                game.choose(choice_text)
+    finally:
+        game.shutdown()
+
+    player = game.player
+    return {
+        'nodes': node_file,
+        'decoder': game.decoder_backend.name,
+        'path': list(choice_path),
+        'completed': not remaining and pending_choice is None,
+        'wall_seconds': time.perf_counter() - started,
+        'stages_ms': {stage: to_ms(timings.percentiles(stage)) for stage in STAGES},
+        'choice_to_first_frame_ms': to_ms(latencies.percentiles('choice_to_first_frame')),
+        'dropped_frames': player.dropped_frames,
+        'underruns': player.underruns,
+        'max_drift_ms': player.max_drift * 1000,
+        'frames_uploaded': player.frames_uploaded,
+        'surface_allocations': player.surface_allocations,
+        'bytes_allocated_per_frame': player.bytes_per_frame,
+        'prefetch_hits': game.prefetcher.hits,
+        'prefetch_misses': game.prefetcher.misses,
+        'memory': game.memory_budget.stats(),
+        'quality': game.quality_controller.quality.name,
+        'quality_changes': game.quality_controller.changes,
+        'startup': game.startup.summary(),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', default=DEFAULT_NODES, help='story graph to load')
+    parser.add_argument('--path', default=DEFAULT_PATH, help='comma separated choice texts to press in order')
+    parser.add_argument('--timeout', type=float, default=600, help='give up after this many seconds')
+    parser.add_argument('--decoder', choices=sorted(BACKENDS), help='video decoder backend to play through')
+    parser.add_argument('--quality', choices=list(QUALITY_LEVELS), help='pin playback to this quality level')
+    parser.add_argument('--memory-budget', type=int, default=MEMORY_BUDGET_BYTES // (1024 * 1024),
+                        help='megabytes all media caches may use together')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    # The game prints playback stats and states as it goes; keep stdout clean for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_benchmark(args.nodes, [choice for choice in args.path.split(',') if choice], args.timeout,
+                               args.decoder, args.quality, args.memory_budget * 1024 * 1024)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0 if report['completed'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
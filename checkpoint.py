@@ -0,0 +1,79 @@
+import json
+import os
+import threading
+import time
+
+# Where the game keeps its session so a crash or restart can pick up where the player was
+CHECKPOINT_PATH = 'checkpoint.json'
+# While a clip plays, the position is saved this often on top of every node transition
+CHECKPOINT_INTERVAL_SECONDS = 5.0
+FORMAT_VERSION = 1
+
+
+def load_checkpoint(path=CHECKPOINT_PATH):
+    """Returns the saved session as a dict, or None if there is none or it can't be used."""
+    try:
+        with open(path, 'r') as file:
+            checkpoint = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(checkpoint, dict) or checkpoint.get('version') != FORMAT_VERSION:
+        return None
+    return checkpoint
+
+
+def write_checkpoint(checkpoint, path=CHECKPOINT_PATH):
+    # Written next to the target and renamed over it, so a crash mid-write leaves the previous checkpoint intact
+    partial = path + '.tmp'
+    with open(partial, 'w') as file:
+        json.dump(checkpoint, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(partial, path)
+
+
+class CheckpointWriter:
+    """Writes checkpoints on a background thread so saving never holds up a frame.
+
+    Only the newest checkpoint matters: one saved while the previous is still being written replaces it rather than
+    queueing behind it.
+    """
+
+    def __init__(self, path=CHECKPOINT_PATH):
+        self.path = path
+        self.pending = None
+        self.closed = False
+        self.writes = 0
+        self.errors = 0
+        self.last_saved = time.perf_counter()
+        self.condition = threading.Condition()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def save(self, checkpoint):
+        with self.condition:
+            self.pending = checkpoint
+            self.last_saved = time.perf_counter()
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                checkpoint, self.pending = self.pending, None
+            try:
+                write_checkpoint(checkpoint, self.path)
+                self.writes += 1
+            except OSError as e:
+                self.errors += 1
+                print(f"Could not write checkpoint {self.path}: {e}")
+
+    def close(self):
+        # Waits for the last checkpoint to reach the disk
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.worker.join()
@@ -0,0 +1,39 @@
+"""Compiles a story's nodes.json into the binary .storyc the game loads node by node.
+
+The game and simulate.py also recompile on their own whenever the JSON is newer than its .storyc; run this to ship
+a story precompiled, or to check that it compiles:
+
+    python compile_story.py --nodes nodes.json
+"""
+import argparse
+import os
+import sys
+import time
+
+from story_store import CompiledNodes, compile_story, compiled_path, is_fresh
+
+DEFAULT_NODES = 'nodes.json'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', default=DEFAULT_NODES, help='story graph to compile')
+    parser.add_argument('--output', help='compiled file to write (default: next to the JSON, as .storyc)')
+    parser.add_argument('--force', action='store_true', help='recompile even if the compiled file is up to date')
+    args = parser.parse_args()
+
+    output = args.output or compiled_path(args.nodes)
+    if not args.force and is_fresh(args.nodes, output):
+        print(f"{output} is up to date")
+        return 0
+    started = time.perf_counter()
+    compile_story(args.nodes, output)
+    nodes = CompiledNodes(output)
+    print(f"{len(nodes)} nodes, {len(nodes.sections['choices'])} choices, "
+          f"{len(nodes.sections['string_offsets']) - 1} strings: {os.path.getsize(args.nodes)} bytes of JSON -> "
+          f"{os.path.getsize(output)} bytes in {output} ({time.perf_counter() - started:.2f}s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""Decoder benchmark: compares clip open latency and decode throughput of each decoder backend.
+
+Every clip is opened twice per backend, so the second open shows what container reuse buys on Replay and Back:
+
+    python decoder_benchmark.py --clips 'assets/example/*.mp4' --size 1280x720 --output decoders.json
+"""
+import argparse
+import glob
+import json
+import sys
+import time
+
+from decoders import BACKENDS, PYAV_INSTALLED, create_backend
+from utils import parse_size
+
+DEFAULT_CLIPS = 'assets/example/*.mp4'
+
+
+def benchmark_clip(backend, video_path, size):
+    result = {}
+    for run in ('cold', 'warm'):
+        open_started = time.perf_counter()
+        clip = backend.open(video_path, size)
+        frames = clip.iter_frames(with_times=True, dtype='uint8')
+        next(frames)
+        result[f'{run}_open_to_first_frame_ms'] = (time.perf_counter() - open_started) * 1000
+
+        decode_started = time.perf_counter()
+        count = 1 + sum(1 for _ in frames)
+        seconds = time.perf_counter() - decode_started
+        result['frames'] = count
+        result[f'{run}_decode_fps'] = (count - 1) / seconds if seconds else 0
+        clip.close()
+
+    seek_started = time.perf_counter()
+    clip = backend.open(video_path, size, start=clip.duration / 2)
+    next(clip.iter_frames(with_times=True, dtype='uint8'))
+    result['seek_to_middle_ms'] = (time.perf_counter() - seek_started) * 1000
+    clip.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clips', default=DEFAULT_CLIPS, help='glob of clips to decode')
+    parser.add_argument('--size', type=parse_size, default=(1280, 720), help='WIDTHxHEIGHT to decode at')
+    parser.add_argument('--decoder', action='append', choices=sorted(BACKENDS),
+                        help='backend to measure, may be repeated (default: all installed)')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    names = args.decoder or [name for name in sorted(BACKENDS) if name != 'pyav' or PYAV_INSTALLED]
+    report = {'size': list(args.size), 'decoders': {}}
+    for name in names:
+        backend = create_backend(name)
+        report['decoders'][name] = {path: benchmark_clip(backend, path, args.size)
+                                    for path in sorted(glob.glob(args.clips))}
+        backend.close()
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
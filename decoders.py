@@ -0,0 +1,288 @@
+import importlib.util
+import re
+import subprocess
+import threading
+
+# PyAV (~0.1 s) and moviepy (~0.3 s, and moviepy.editor a whole second) are only imported once a backend needs
+# them, which the game does on its loader thread while the window is already up
+av = None
+
+# Idle PyAV containers kept open so Replay, Back and revisited nodes skip the probe
+CONTAINER_POOL_SIZE = 8
+# Clip audio is decoded to interleaved 16 bit stereo at this rate
+AUDIO_FREQUENCY = 44100
+AUDIO_CHANNELS = 2
+
+
+def open_indexed_clip(video_path, probed, size):
+    """A moviepy VideoFileClip scaled to `size`, set up from media index metadata instead of an ffmpeg probe.
+
+    Does what VideoFileClip and FFMPEG_VideoReader do in their constructors, minus ffmpeg_parse_infos().
+    """
+    from moviepy.video.VideoClip import VideoClip
+    from moviepy.video.io.VideoFileClip import VideoFileClip
+    from moviepy.video.io.ffmpeg_reader import FFMPEG_VideoReader
+    width, height = size
+    fps, duration = probed['fps'], probed['duration']
+    reader = FFMPEG_VideoReader.__new__(FFMPEG_VideoReader)
+    reader.filename = video_path
+    reader.proc = None
+    reader.fps = fps
+    reader.size = (width, height)
+    reader.rotation = 0
+    reader.resize_algo = 'bicubic'
+    reader.duration = reader.ffmpeg_duration = duration
+    reader.nframes = int(duration * fps) + 1
+    reader.infos = {'duration': duration, 'video_found': True, 'video_fps': fps, 'video_duration': duration,
+                    'video_size': [probed['width'], probed['height']], 'video_nframes': reader.nframes,
+                    'video_rotation': 0, 'audio_found': probed['audio']}
+    reader.pix_fmt = 'rgb24'
+    reader.depth = 3
+    reader.bufsize = reader.depth * width * height + 100
+    reader.initialize()
+    reader.pos = 1
+    reader.lastread = reader.read_frame()
+
+    clip = VideoFileClip.__new__(VideoFileClip)
+    VideoClip.__init__(clip)
+    clip.reader = reader
+    clip.duration = clip.end = duration
+    clip.fps = fps
+    clip.size = reader.size
+    clip.rotation = 0
+    clip.filename = video_path
+    clip.make_frame = lambda t: reader.get_frame(t)
+    return clip
+
+
+class MoviepyBackend:
+    """Decodes through moviepy, i.e. an ffmpeg subprocess per clip with frames coming over a pipe."""
+
+    name = 'moviepy'
+
+    def __init__(self, media_index=None):
+        # Clips indexed by preflight.py open without moviepy first running ffmpeg once just to probe them
+        self.media_index = media_index
+
+    def open(self, video_path, size, start=0.0, quality=None):
+        # ffmpeg scales while decoding, so frames already arrive at the window size. Of a quality level only the
+        # size applies, ffmpeg picks its own scaler and decodes every frame
+        probed = self.media_index.get(video_path) if self.media_index is not None else None
+        if probed is not None and probed.get('fps') and probed.get('duration'):
+            clip = open_indexed_clip(video_path, probed, size)
+        else:
+            from moviepy.video.io.VideoFileClip import VideoFileClip
+            width, height = size
+            clip = VideoFileClip(video_path, audio=False, target_resolution=(height, width))
+        return clip.subclip(start) if start else clip
+
+    def decode_audio(self, video_path, cancelled=lambda: False, has_audio=None):
+        # Returns raw PCM (empty for a silent clip), or None if cancelled between two one-second chunks. has_audio
+        # comes from the media index when known, saving a probe
+        from moviepy.audio.io.AudioFileClip import AudioFileClip
+        from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+        if has_audio is None:
+            has_audio = ffmpeg_parse_infos(video_path)['audio_found']
+        if not has_audio:
+            return b''
+        chunks = []
+        clip = AudioFileClip(video_path, fps=AUDIO_FREQUENCY, nbytes=2)
+        try:
+            # Chunk by chunk like bake.py; to_soundarray() hands np.vstack a generator, which numpy 2 refuses
+            for samples in clip.iter_chunks(fps=AUDIO_FREQUENCY, quantize=True, nbytes=2, chunksize=AUDIO_FREQUENCY):
+                if cancelled():
+                    return None
+                chunks.append(samples.astype('<i2').tobytes())
+        finally:
+            clip.close()
+        return b''.join(chunks)
+
+    def probe(self, video_path):
+        from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+        infos = ffmpeg_parse_infos(video_path)
+        width, height = infos['video_size']
+        return {'duration': infos['duration'], 'fps': infos['video_fps'], 'width': width, 'height': height,
+                'audio': infos['audio_found']}
+
+    def end_frames(self, video_path):
+        # (first, last) frames as RGB arrays at the clip's own size
+        from moviepy.video.io.VideoFileClip import VideoFileClip
+        clip = VideoFileClip(video_path, audio=False)
+        try:
+            return clip.get_frame(0), clip.get_frame(max(0, clip.duration - 1 / clip.fps))
+        finally:
+            clip.close()
+
+    def keyframes(self, video_path):
+        # Timestamps of the clip's keyframes; ffmpeg decodes only the keyframes themselves and reports their times
+        from moviepy.config import get_setting
+        command = [get_setting('FFMPEG_BINARY'), '-hide_banner', '-skip_frame', 'nokey', '-i', video_path, '-an',
+                   '-vf', 'showinfo', '-f', 'null', '-']
+        output = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True).stderr
+        return [float(match) for match in re.findall(rb'pts_time:\s*(-?[0-9.]+)', output)]
+
+    def close(self):
+        pass
+
+
+class PyAVClip:
+    """Stands in for a VideoFileClip decoding in-process through PyAV. Closing hands the container back to the pool."""
+
+    def __init__(self, backend, video_path, container, size, start=0.0, quality=None):
+        self.backend = backend
+        self.filename = video_path
+        self.container = container
+        self.stream = container.streams.video[0]
+        self.size = size
+        self.start = start
+        self.quality = quality
+        self.fps = float(self.stream.average_rate or 0)
+        if self.stream.duration is not None:
+            duration = float(self.stream.duration * self.stream.time_base)
+        else:
+            duration = container.duration / av.time_base
+        self.duration = duration - start
+
+    def iter_frames(self, with_times=True, dtype='uint8'):
+        stream = self.stream
+        offset = float(stream.start_time * stream.time_base) if stream.start_time is not None else 0.0
+        # Seeking lands on the keyframe at or before start; the frames in between are decoded and skipped
+        self.container.seek(int((self.start + offset) / stream.time_base), stream=stream, backward=True)
+        earliest = self.start - (0.5 / self.fps if self.fps else 0)
+        t = -1 / self.fps if self.fps else 0
+        skip_frame = None
+        for frame in self.container.decode(stream):
+            # Size and quality may change between two frames, see configure()
+            quality = self.quality
+            if quality is not None and quality.skip_frame != skip_frame:
+                skip_frame = quality.skip_frame
+                stream.codec_context.skip_frame = skip_frame or 'DEFAULT'
+            t = frame.time - offset if frame.time is not None else t + (1 / self.fps if self.fps else 0)
+            if t < earliest:
+                continue
+            # swscale converts and scales in the same pass, no pipe and no extra copy
+            width, height = self.size
+            array = frame.to_ndarray(format='rgb24', width=width, height=height,
+                                     interpolation=quality.interpolation if quality is not None else None)
+            yield (t - self.start, array) if with_times else array
+
+    def configure(self, size, quality):
+        # Frames are converted one at a time, so a new decode size or quality needs no reopen
+        self.size = size
+        self.quality = quality
+
+    def subclip(self, start):
+        return self.backend.open(self.filename, self.size, start=self.start + start, quality=self.quality)
+
+    def close(self):
+        if self.container is not None:
+            # Pooled containers are handed out again, so don't leave frame skipping switched on
+            self.stream.codec_context.skip_frame = 'DEFAULT'
+            self.backend.release(self.filename, self.container)
+            self.container = None
+
+
+class PyAVBackend:
+    """Decodes in-process with PyAV, using FFmpeg's own slice/frame threads, and reuses open containers."""
+
+    name = 'pyav'
+
+    def __init__(self, pool_size=CONTAINER_POOL_SIZE):
+        global av
+        if av is None:
+            import av
+        self.pool_size = pool_size
+        self.idle = []
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+
+    def open(self, video_path, size, start=0.0, quality=None):
+        container = self.acquire(video_path)
+        if container is None:
+            container = av.open(video_path)
+            container.streams.video[0].thread_type = 'AUTO'
+        return PyAVClip(self, video_path, container, size, start, quality)
+
+    def decode_audio(self, video_path, cancelled=lambda: False, has_audio=None):
+        # Returns raw PCM (empty for a silent clip), or None if cancelled; uses its own container, not the pool's
+        chunks = []
+        with av.open(video_path) as container:
+            if not container.streams.audio:
+                return b''
+            resampler = av.AudioResampler(format='s16', layout='stereo', rate=AUDIO_FREQUENCY)
+            for frame in container.decode(container.streams.audio[0]):
+                if cancelled():
+                    return None
+                chunks.extend(resampled.to_ndarray().tobytes() for resampled in resampler.resample(frame))
+            chunks.extend(resampled.to_ndarray().tobytes() for resampled in resampler.resample(None))
+        return b''.join(chunks)
+
+    def probe(self, video_path):
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            if stream.duration is not None:
+                duration = float(stream.duration * stream.time_base)
+            else:
+                duration = container.duration / av.time_base
+            return {'duration': duration, 'fps': float(stream.average_rate or 0), 'width': stream.width,
+                    'height': stream.height, 'audio': bool(container.streams.audio)}
+
+    def end_frames(self, video_path):
+        # (first, last) frames as RGB arrays at the clip's own size; only the last GOP is decoded for the last one
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            first = next(container.decode(stream)).to_ndarray(format='rgb24')
+            duration = stream.duration * stream.time_base if stream.duration is not None else 0
+            container.seek(int(max(0, duration - 1) / stream.time_base), stream=stream, backward=True)
+            last = None
+            for frame in container.decode(stream):
+                last = frame
+            return first, last.to_ndarray(format='rgb24') if last is not None else first
+
+    def keyframes(self, video_path):
+        # Timestamps of the clip's keyframes, from the packet headers alone; nothing is decoded
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            start_time = stream.start_time or 0
+            return sorted(float((packet.pts - start_time) * stream.time_base) for packet in container.demux(stream)
+                          if packet.is_keyframe and packet.pts is not None)
+
+    def acquire(self, video_path):
+        with self.lock:
+            for index, (path, container) in enumerate(self.idle):
+                if path == video_path:
+                    del self.idle[index]
+                    self.reused += 1
+                    return container
+            self.opened += 1
+        return None
+
+    def release(self, video_path, container):
+        with self.lock:
+            self.idle.append((video_path, container))
+            evicted = self.idle[:-self.pool_size] if len(self.idle) > self.pool_size else []
+            del self.idle[:len(evicted)]
+        for _, container in evicted:
+            container.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for _, container in idle:
+            container.close()
+
+
+BACKENDS = {backend.name: backend for backend in (MoviepyBackend, PyAVBackend)}
+PYAV_INSTALLED = importlib.util.find_spec('av') is not None
+DEFAULT_BACKEND = 'pyav' if PYAV_INSTALLED else 'moviepy'
+
+
+def create_backend(name=None, media_index=None):
+    name = name or DEFAULT_BACKEND
+    if name == 'pyav' and not PYAV_INSTALLED:
+        raise ValueError("The pyav decoder needs PyAV installed (pip install av)")
+    if name == 'moviepy':
+        return MoviepyBackend(media_index)
+    # PyAV learns a clip's metadata from the container headers it reads to open it anyway; its pool keeps them open
+    return BACKENDS[name]()
@@ -0,0 +1,172 @@
+import json
+import mmap
+import os
+import shutil
+
+import numpy as np
+
+from utils import closest_size, file_signature
+
+# Where bake.py writes pre-transcoded clips, and the resolutions it bakes by default
+BAKE_DIR = 'assets/baked'
+BAKE_RESOLUTIONS = [(1280, 720)]
+# Frames per memory-mapped chunk file
+CHUNK_FRAMES = 120
+AUDIO_FPS = 44100
+INDEX_FILE = 'index.json'
+
+
+def store_dir(video_path, size, bake_dir=BAKE_DIR):
+    width, height = size
+    return os.path.join(bake_dir, video_path + '.baked', f'{width}x{height}')
+
+
+def bake_clip(video_path, size, bake_dir=BAKE_DIR):
+    """Decodes a clip once into raw RGB chunk files plus 16 bit PCM audio. Runs in a bake.py worker process."""
+    # Imported here so playing baked clips never loads moviepy
+    from moviepy.video.io.VideoFileClip import VideoFileClip
+    target = store_dir(video_path, size, bake_dir)
+    partial = target + '.partial'
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+
+    width, height = size
+    clip = VideoFileClip(video_path, target_resolution=(height, width))
+    try:
+        timestamps = []
+        chunk = None
+        for index, (t, frame) in enumerate(clip.iter_frames(with_times=True, dtype='uint8')):
+            if index % CHUNK_FRAMES == 0:
+                if chunk is not None:
+                    chunk.close()
+                chunk = open(os.path.join(partial, f'chunk_{index // CHUNK_FRAMES:05d}.raw'), 'wb')
+            chunk.write(frame.tobytes())
+            timestamps.append(t)
+        if chunk is not None:
+            chunk.close()
+
+        audio = None
+        if clip.audio is not None:
+            with open(os.path.join(partial, 'audio.pcm'), 'wb') as pcm:
+                for samples in clip.audio.iter_chunks(fps=AUDIO_FPS, quantize=True, nbytes=2, chunksize=AUDIO_FPS):
+                    pcm.write(samples.astype('<i2').tobytes())
+            audio = {'file': 'audio.pcm', 'fps': AUDIO_FPS, 'channels': clip.audio.nchannels}
+
+        index = {
+            'source': video_path,
+            'width': width,
+            'height': height,
+            'fps': clip.fps,
+            'duration': clip.duration,
+            'timestamps': timestamps,
+            'chunk_frames': CHUNK_FRAMES,
+            'audio': audio,
+            'source_signature': list(file_signature(video_path)),
+        }
+    finally:
+        clip.close()
+
+    # The index is written last and the directory swapped in whole, so readers never see half a store
+    with open(os.path.join(partial, INDEX_FILE), 'w') as file:
+        json.dump(index, file)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(partial, target)
+    return target
+
+
+def read_index(directory):
+    try:
+        with open(os.path.join(directory, INDEX_FILE), 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def fresh_stores(video_path, bake_dir=BAKE_DIR):
+    # (index, directory) of every bake of this clip made from the source file as it is now
+    base = os.path.join(bake_dir, video_path + '.baked')
+    if not os.path.isdir(base):
+        return []
+    try:
+        signature = list(file_signature(video_path))
+    except OSError:
+        return []
+
+    stores = []
+    for name in os.listdir(base):
+        index = read_index(os.path.join(base, name))
+        if index is not None and index.get('source_signature') == signature:
+            stores.append((index, os.path.join(base, name)))
+    return stores
+
+
+def find_store(video_path, size, bake_dir=BAKE_DIR):
+    """Returns the directory of the best fresh baked store for this window size, or None to fall back to decoding.
+
+    Prefers an exact size match, then the smallest bake larger than the window, then the largest one.
+    """
+    candidates = {(index['width'], index['height']): directory
+                  for index, directory in fresh_stores(video_path, bake_dir)}
+    if not candidates:
+        return None
+    return candidates[closest_size(candidates, size)]
+
+
+def find_audio(video_path, bake_dir=BAKE_DIR):
+    """Returns (pcm path, sample rate, channels) from any fresh bake of the clip, or None."""
+    for index, directory in fresh_stores(video_path, bake_dir):
+        audio = index['audio']
+        if audio:
+            return os.path.join(directory, audio['file']), audio['fps'], audio['channels']
+    return None
+
+
+class FrameStore:
+    """A baked clip played straight from mmap; quacks like the VideoFileClip parts FrameDecoder and VideoPlayer use."""
+
+    def __init__(self, directory, start=0.0, maps=None):
+        self.directory = directory
+        self.index = read_index(directory)
+        self.filename = self.index['source']
+        self.fps = self.index['fps']
+        self.duration = self.index['duration'] - start
+        self.size = (self.index['width'], self.index['height'])
+        self.start = start
+        self.frame_bytes = self.index['width'] * self.index['height'] * 3
+        # Sub-clips share their parent's maps; only the owner closes them
+        self.owns_maps = maps is None
+        self.maps = maps if maps is not None else {}
+
+    def chunk(self, number):
+        chunk_map = self.maps.get(number)
+        if chunk_map is None:
+            with open(os.path.join(self.directory, f'chunk_{number:05d}.raw'), 'rb') as file:
+                chunk_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[number] = chunk_map
+        return chunk_map
+
+    def iter_frames(self, with_times=True, dtype='uint8'):
+        width, height = self.size
+        chunk_frames = self.index['chunk_frames']
+        for number, t in enumerate(self.index['timestamps']):
+            if t < self.start:
+                continue
+            chunk_map = self.chunk(number // chunk_frames)
+            offset = (number % chunk_frames) * self.frame_bytes
+            # A view onto the page cache, no decode and no copy
+            frame = np.frombuffer(chunk_map, dtype='uint8', count=self.frame_bytes, offset=offset)
+            frame = frame.reshape(height, width, 3)
+            yield (t - self.start, frame) if with_times else frame
+
+    def subclip(self, start):
+        return FrameStore(self.directory, self.start + start, self.maps)
+
+    def close(self):
+        if self.owns_maps:
+            for chunk_map in self.maps.values():
+                try:
+                    chunk_map.close()
+                except BufferError:
+                    # A frame view is still alive somewhere; the map is released with it
+                    pass
+            self.maps.clear()
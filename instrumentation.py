@@ -0,0 +1,237 @@
+import contextlib
+import csv
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+import pygame
+
+# Samples kept per stage by the rolling histogram behind the overlay
+ROLLING_WINDOW = 600
+# Frame times shown in the overlay graph, and the frame time that fills the graph's height
+GRAPH_FRAMES = 120
+GRAPH_MAX_SECONDS = 0.05
+
+
+class Instrumentation:
+    """Fans stage durations and gauges out to pluggable sinks.
+
+    Callers guard their perf_counter() calls with `enabled`, so with no sinks attached the cost is one attribute check.
+    """
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+        self.enabled = bool(self.sinks)
+
+    def add_sink(self, sink):
+        if sink not in self.sinks:
+            self.sinks.append(sink)
+        self.enabled = True
+
+    def remove_sink(self, sink):
+        if sink in self.sinks:
+            self.sinks.remove(sink)
+        self.enabled = bool(self.sinks)
+
+    def record(self, stage, seconds):
+        for sink in self.sinks:
+            sink.record(stage, seconds)
+
+    def gauge(self, name, value):
+        for sink in self.sinks:
+            sink.gauge(name, value)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+class StageTimings:
+    """Sink that keeps every sample, for percentiles over a whole run (see benchmark.py)."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.gauges = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.samples[stage].append(seconds)
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def percentiles(self, stage, points=(50, 90, 99)):
+        with self.lock:
+            samples = sorted(self.samples.get(stage, ()))
+        return percentiles(samples, points)
+
+    def close(self):
+        pass
+
+
+class RollingHistogram(StageTimings):
+    """Sink that only keeps the most recent `window` samples per stage, for live views."""
+
+    def __init__(self, window=ROLLING_WINDOW):
+        super().__init__()
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+
+    def recent(self, stage, count):
+        with self.lock:
+            samples = list(self.samples.get(stage, ()))
+        return samples[-count:]
+
+
+class TraceFile:
+    """Sink that streams every sample to a .jsonl or .csv file as (time, kind, name, value)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'w', newline='')
+        self.started = time.perf_counter()
+        if path.endswith('.csv'):
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(['time', 'kind', 'name', 'value'])
+        else:
+            self.writer = None
+
+    def write(self, kind, name, value):
+        timestamp = time.perf_counter() - self.started
+        with self.lock:
+            if self.file.closed:
+                return
+            if self.writer is not None:
+                self.writer.writerow([f'{timestamp:.6f}', kind, name, value])
+            else:
+                self.file.write(json.dumps({'time': timestamp, 'kind': kind, 'name': name, 'value': value}) + '\n')
+
+    def record(self, stage, seconds):
+        self.write('stage', stage, seconds)
+
+    def gauge(self, name, value):
+        self.write('gauge', name, value)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class StartupProfile:
+    """Where the time to the first frame goes: named phases as (name, thread, start, end) perf_counter spans.
+
+    Phases on the loader and prefetch threads overlap those on the game thread, so the spans are reported on one
+    timeline from process start rather than summed.
+    """
+
+    def __init__(self, started_at=None):
+        self.started_at = time.perf_counter() if started_at is None else started_at
+        self.phases = []
+        self.first_frame = None
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter())
+
+    def add(self, name, start, end, thread=None):
+        with self.lock:
+            self.phases.append((name, thread or threading.current_thread().name, start, end))
+
+    def frame_shown(self):
+        # True only for the first call
+        if self.first_frame is not None:
+            return False
+        self.first_frame = time.perf_counter()
+        return True
+
+    def summary(self):
+        with self.lock:
+            phases = sorted(self.phases, key=lambda phase: phase[2])
+        return {
+            'first_frame_ms': (self.first_frame - self.started_at) * 1000 if self.first_frame is not None else None,
+            'phases': [{'name': name, 'thread': thread, 'start_ms': (start - self.started_at) * 1000,
+                        'duration_ms': (end - start) * 1000} for name, thread, start, end in phases],
+        }
+
+    def report(self):
+        summary = self.summary()
+        first_frame = summary['first_frame_ms']
+        lines = [f"Startup: first frame after {first_frame:.0f} ms" if first_frame is not None
+                 else "Startup: no frame shown yet"]
+        for phase in summary['phases']:
+            end = phase['start_ms'] + phase['duration_ms']
+            lines.append(f"  {phase['name']:<16} {phase['thread']:<12} {phase['start_ms']:7.1f} -> {end:7.1f} ms"
+                         f"  ({phase['duration_ms']:.1f} ms)")
+        return '\n'.join(lines)
+
+
+class PerformanceOverlay:
+    """Toggleable on-screen panel with fps, a frame-time graph, buffer depth, cache hit rates,
+    playback quality and memory use."""
+
+    def __init__(self, instrumentation):
+        self.instrumentation = instrumentation
+        self.histogram = RollingHistogram()
+        self.visible = False
+        self.font = None
+
+    def toggle(self):
+        self.visible = not self.visible
+        if self.visible:
+            self.instrumentation.add_sink(self.histogram)
+        else:
+            self.instrumentation.remove_sink(self.histogram)
+
+    def draw(self, screen):
+        if not self.visible:
+            return
+        if self.font is None:
+            self.font = pygame.font.Font(None, 20)
+
+        frame_times = self.histogram.recent('frame', GRAPH_FRAMES)
+        frame_stats = percentiles(sorted(frame_times))
+        fps = len(frame_times) / sum(frame_times) if frame_times and sum(frame_times) else 0
+        gauges = self.histogram.gauges
+        p50, p99 = frame_stats.get('p50', 0) * 1000, frame_stats.get('p99', 0) * 1000
+        lines = [
+            f"{fps:5.1f} fps   p50 {p50:4.1f} ms   p99 {p99:4.1f} ms",
+            f"frame buffer {gauges.get('queue_depth', 0)}/{gauges.get('queue_capacity', 0)}"
+            f"   dropped {gauges.get('dropped_frames', 0)}   underruns {gauges.get('underruns', 0)}",
+            f"image cache {gauges.get('image_cache_hit_rate', 0):.0%}"
+            f"   prefetch {gauges.get('prefetch_hit_rate', 0):.0%}"
+            f"   audio {gauges.get('audio_cache_hit_rate', 0):.0%}",
+            f"quality {gauges.get('quality', 'full')}"
+            f"   memory {gauges.get('memory_bytes', 0) / 2 ** 20:.0f}/{gauges.get('memory_budget_bytes', 0) / 2 ** 20:.0f} MB",
+        ]
+
+        width, line_height, graph_height = 360, 18, 50
+        panel = pygame.Surface((width, len(lines) * line_height + graph_height + 12), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 170))
+        for index, line in enumerate(lines):
+            panel.blit(self.font.render(line, True, (255, 255, 255)), (6, 4 + index * line_height))
+
+        graph_top = len(lines) * line_height + 8
+        bar_width = width / GRAPH_FRAMES
+        for index, frame_time in enumerate(frame_times):
+            bar_height = min(graph_height, int(frame_time / GRAPH_MAX_SECONDS * graph_height))
+            color = (90, 220, 90) if frame_time <= 1 / 55 else (230, 80, 60)
+            panel.fill(color, (int(index * bar_width), graph_top + graph_height - bar_height,
+                               max(1, int(bar_width)), bar_height))
+        screen.blit(panel, (10, 10))
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    # `samples` must already be sorted
+    if not samples:
+        return {}
+    result = {f'p{point}': samples[min(len(samples) - 1, len(samples) * point // 100)] for point in points}
+    result['max'] = samples[-1]
+    result['count'] = len(samples)
+    return result
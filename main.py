@@ -1,199 +1,461 @@
+import time
+
+# Taken before anything else is imported, so the startup profile covers the imports too
+STARTED_AT = time.perf_counter()
+
 import pygame
 import pygame_gui
-from moviepy.editor import VideoFileClip
+import argparse
 import sys
 import threading
-import json
+
+from audio import AudioPlayer
+from checkpoint import (CheckpointWriter, load_checkpoint, CHECKPOINT_INTERVAL_SECONDS, CHECKPOINT_PATH,
+                        FORMAT_VERSION)
+from decoders import AUDIO_CHANNELS, AUDIO_FREQUENCY, BACKENDS, create_backend
+from instrumentation import Instrumentation, PerformanceOverlay, StartupProfile, TraceFile
+from media_cache import (AudioCache, ClipFrameCache, HeldSurfaces, ImageCache, MemoryBudget, AUDIO_CACHE_MAX_BYTES,
+                         CLIP_CACHE_MAX_BYTES, IMAGE_CACHE_MAX_BYTES, MEMORY_BUDGET_BYTES)
+from media_index import MediaIndex
+from playback import VideoPlayer, Prefetcher, FRAME_BUFFER_DEPTH, FRAME_BUFFER_MAX_BYTES, PREFETCH_FRAMES
+from quality import QUALITY_LEVELS, QualityController
+from story import (GameState, build_trigger_index, enter_node, find_gapless_successors, is_choice_available,
+                   state_names, story_media)
+from story_store import load_story
+
+IMPORTED_AT = time.perf_counter()
 
 # nodepath = "node.json"
 nodepath = "nodes.json"
-class GameState:
-    def __init__(self):
-        self.states = {
-            'energy': 0,  # Example of a numeric state
-            'mood': 0,
-            'alcohol': 0,
-            'time': 0
-            # Add other states as needed
-        }
-
-    def set_state(self, state_name, value):
-        self.states[state_name] = value
-
-    def get_state(self, state_name):
-        return self.states.get(state_name)
-
-    def increase_state(self, state_name, amount):
-        if state_name in self.states:
-            self.states[state_name] += amount
-
-    def decrease_state(self, state_name, amount):
-        if state_name in self.states:
-            self.states[state_name] -= amount
-
-    def check_state(self, state_name, condition):
-        return condition(self.get_state(state_name))
-
-
-class Node:
-    def __init__(self, media_path, choices, conditions=None, is_video=True, state_actions=None, instant_trigger=None):
-        self.media_path = media_path
-        self.choices = choices
-        self.conditions = conditions if conditions else {}
-        self.is_video = is_video
-        self.state_actions = state_actions if state_actions else {'set': {}, 'increase': {}, 'decrease': {}}
-        self.instant_trigger = instant_trigger if instant_trigger else {}  # New attribute
-
+# How long an idle choice screen sleeps waiting for input before checking the UI again
+IDLE_WAIT_MS = 250
+# How long before the end of a clip the next clip of a single-choice chain is pre-rolled
+GAPLESS_PREROLL_SECONDS = 2.0
+# Shown centred on the splash screen and as the window icon
+ICON_PATH = 'assets/example/icon.jpg'
 
 
 class Game:
-    def __init__(self):
-        self.game_state = GameState()
-        pygame.init()
-        pygame.display.set_caption('A Day in the Life of a Developer')
-
-        self.screen_width, self.screen_height = (1280, 720)
-        self.screen = pygame.display.set_mode((self.screen_width, self.screen_height), pygame.RESIZABLE)
-        self.ui_manager = pygame_gui.UIManager((self.screen_width, self.screen_height))
-        # add icon in example path
-        icon = pygame.image.load('assets/example/icon.jpg')
-        pygame.display.set_icon(icon)
+    def __init__(self, node_file=None, instrumentation=None, decoder=None, quality=None, quality_log=None,
+                 memory_budget=MEMORY_BUDGET_BYTES, profile_startup=False, checkpoint_path=None, resume=False):
+        self.startup = StartupProfile(STARTED_AT)
+        self.startup.add('imports', STARTED_AT, IMPORTED_AT, 'MainThread')
+        self.profile_startup = profile_startup
+        with self.startup.phase('window'):
+            pygame.mixer.pre_init(AUDIO_FREQUENCY, -16, AUDIO_CHANNELS)
+            pygame.init()
+            pygame.display.set_caption('A Day in the Life of a Developer')
+
+            self.screen_width, self.screen_height = (1280, 720)
+            self.screen = pygame.display.set_mode((self.screen_width, self.screen_height), pygame.RESIZABLE)
+            # add icon in example path
+            icon = pygame.image.load(ICON_PATH)
+            pygame.display.set_icon(icon)
+            self.show_splash(icon)
         self.game_is_running = True
         self.clock = pygame.time.Clock()
         self.node_history = []
-        self.last_frame = None
-
-        self.nodes = self.load_nodes_from_json(nodepath)
-
-        self.current_node = self.nodes['intro_node']
-        self.intro_node = self.nodes['intro_node']  # Define intro_node here
-
+        self.revisiting = False
+        # Dirty tracking for still screens: the scaled backdrop is cached per window size and only the UI is redrawn
+        self.needs_redraw = True
+        self.ui_signature = None
+        # Per-stage timings and gauges go to whatever sinks are attached (trace file, overlay, benchmark)
+        self.instrumentation = instrumentation or Instrumentation()
+        # Every cache below registers here, so together they stay within one byte budget
+        self.memory_budget = MemoryBudget(memory_budget)
+        self.image_cache = self.memory_budget.register('images', ImageCache(IMAGE_CACHE_MAX_BYTES))
+        # Whole decoded clips, so Replay and Back don't go through the decoder again
+        self.frame_cache = self.memory_budget.register('clip_frames', ClipFrameCache(CLIP_CACHE_MAX_BYTES))
+        # The last frame of the clip that just ended, and its copy scaled to the window
+        self.held_frames = self.memory_budget.register('held_frames', HeldSurfaces())
+        # Decoded clip audio, played through pygame.mixer
+        self.audio_cache = self.memory_budget.register('audio', AudioCache(AUDIO_CACHE_MAX_BYTES))
+
+        # Session saves, written in the background on every transition and every few seconds of a clip
+        self.checkpoints = CheckpointWriter(checkpoint_path) if checkpoint_path else None
+        self.resumed = None
+
+        # The story, decoder and first clip load on their own thread while the UI is set up here
+        self.node_file = node_file or nodepath
+        self.load_error = None
+        checkpoint_file = checkpoint_path if resume else None
+        loader = threading.Thread(target=self.load, args=(self.node_file, decoder, checkpoint_file), name='loader',
+                                  daemon=True)
+        loader.start()
+        with self.startup.phase('ui'):
+            self.ui_manager = pygame_gui.UIManager((self.screen_width, self.screen_height))
+            self.overlay = PerformanceOverlay(self.instrumentation)
+        with self.startup.phase('loader_wait'):
+            while loader.is_alive():
+                # Keep the window responsive while the splash is up
+                pygame.event.pump()
+                loader.join(0.05)
+        if self.load_error is not None:
+            raise self.load_error
+
+        self.player = VideoPlayer(FRAME_BUFFER_DEPTH, FRAME_BUFFER_MAX_BYTES, self.prefetcher, self.instrumentation,
+                                  self.frame_cache, self.decoder_backend, self.audio)
+        self.memory_budget.register('playback', self.player)
+        # Trades picture quality for smooth playback on machines that can't keep up; a named level pins it there
+        self.quality_controller = QualityController(self.player, self.instrumentation,
+                                                    QUALITY_LEVELS[quality] if quality else None,
+                                                    adaptive=quality is None, log_path=quality_log)
         self.video_played = False
+        if self.resumed is not None:
+            self.resume(self.resumed)
+        self.ready_at = time.perf_counter()
+
+    def show_splash(self, icon):
+        self.screen.fill((0, 0, 0))
+        self.screen.blit(icon, icon.get_rect(center=self.screen.get_rect().center))
+        pygame.display.flip()
+
+    def load(self, node_file, decoder, checkpoint_file=None):
+        # Runs on the loader thread. Ends by prefetching the intro clip, so it opens and pre-rolls while the game
+        # thread finishes setting up
+        try:
+            with self.startup.phase('story'):
+                self.nodes = self.load_nodes_from_json(node_file)
+                self.game_state = GameState(state_names(self.nodes))
+                self.trigger_index = build_trigger_index(self.nodes)
+                self.gapless_successors = find_gapless_successors(self.nodes)
+            with self.startup.phase('media_index'):
+                # Probed metadata written by preflight.py
+                self.media_index = MediaIndex()
+                self.check_media()
+            with self.startup.phase('decoder'):
+                # One decoder backend shared by prefetching and playback, so open containers are reused across both;
+                # the moviepy backend opens indexed clips without probing them
+                self.decoder_backend = create_backend(decoder, self.media_index)
+            with self.startup.phase('audio'):
+                self.audio = AudioPlayer(self.audio_cache, self.decoder_backend, self.instrumentation,
+                                         self.media_index)
+            self.prefetcher = Prefetcher(PREFETCH_FRAMES, FRAME_BUFFER_MAX_BYTES, self.instrumentation,
+                                         self.frame_cache, self.decoder_backend)
+            self.memory_budget.register('prefetch', self.prefetcher)
+
+            self.current_node = self.nodes['intro_node']
+            self.intro_node = self.nodes['intro_node']  # Define intro_node here
+            checkpoint = load_checkpoint(checkpoint_file) if checkpoint_file else None
+            if checkpoint is not None:
+                # Restored here so the clips prefetched next are the resumed node's, not the intro's
+                self.restore(checkpoint)
+            self.prefetch_next_clips()
+            # Kept for the startup profile, the player takes it out of the prefetcher
+            self.first_clip = self.prefetcher.prepared.get(self.current_node.media_path)
+        except Exception as e:
+            self.load_error = e
 
     def load_nodes_from_json(self, json_file):
-        with open(json_file, 'r') as file:
-            data = json.load(file)
-
-        nodes = {}
-        for key, value in data.items():
-            nodes[key] = Node(**value)
-
-        return nodes
+        # Through the compiled story, rebuilt first if the JSON changed; nodes are read as they are visited
+        return load_story(json_file)
+
+    def restore(self, checkpoint):
+        # Node, history and states of a saved session; playback resumes once the player exists, see resume()
+        if checkpoint.get('story') != self.node_file or checkpoint.get('node') not in self.nodes:
+            print(f"Checkpoint does not match {self.node_file}, starting from the beginning")
+            return
+        self.current_node = self.nodes[checkpoint['node']]
+        self.node_history = [node_key for node_key in checkpoint.get('history', []) if node_key in self.nodes]
+        columns = self.game_state.session_states.columns
+        self.game_state.states = {state_name: value for state_name, value in checkpoint.get('states', {}).items()
+                                  if state_name in columns}
+        self.resumed = checkpoint
+
+    def resume(self, checkpoint):
+        node = self.current_node
+        position = checkpoint.get('position')
+        if not node.is_video:
+            self.show_choices(node.choices)
+        elif checkpoint.get('video_played') or not node.media_path:
+            self.show_end_of_clip()
+        elif position:
+            # From the keyframe at or before the saved position, so decoding starts right where playback does
+            keyframe = self.media_index.keyframe_before(node.media_path, position)
+            start = keyframe if keyframe is not None else position
+            self.player.play(node.media_path, self.screen.get_size(), start)
+            print(f"Resuming {node.media_path} at {start:.2f}s (saved at {position:.2f}s)")
+        print(f"Resumed session at {node.key}")
+
+    def checkpoint(self):
+        # Playback position only while the current node's clip is the one playing
+        position = self.player.position if self.player.video_path == self.current_node.media_path else None
+        return {'version': FORMAT_VERSION, 'story': self.node_file, 'node': self.current_node.key,
+                'history': list(self.node_history),
+                'states': {state_name: int(value) for state_name, value in self.game_state.states.items()},
+                'position': position, 'video_played': self.video_played, 'saved_at': time.time()}
+
+    def save_checkpoint(self):
+        if self.checkpoints is not None:
+            self.checkpoints.save(self.checkpoint())
 
     def run(self):
         while self.game_is_running:
+            self.tick()
+
+        self.shutdown()
+        sys.exit()
+
+    def tick(self):
+        if self.is_idle():
+            # Nothing moves on a still choice screen: sleep until there is input instead of redrawing at 60 fps
+            event = pygame.event.wait(IDLE_WAIT_MS)
+            events = [event] if event.type != pygame.NOEVENT else []
+            events += pygame.event.get()
+            time_delta = self.clock.tick() / 1000.0
+        else:
             # set energy level
             time_delta = self.clock.tick(60) / 1000.0
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.game_is_running = False
-
-                if event.type == pygame.VIDEORESIZE:
-                    # Resize event: Update screen and UI manager resolution
-                    self.screen_width, self.screen_height = event.size
-                    self.screen = pygame.display.set_mode((self.screen_width, self.screen_height), pygame.RESIZABLE)
-                    self.ui_manager.set_window_resolution((self.screen_width, self.screen_height))
-
-                    # Clear existing UI and show choices if the video has been played
-                    if self.video_played:
-                        self.ui_manager.clear_and_reset()
-                        self.show_choices(self.current_node.choices)
-
-                    # Handle other events
-                self.ui_manager.process_events(event)
-
-                if event.type == pygame_gui.UI_BUTTON_PRESSED:
-                    if event.ui_element.text == 'Replay':
-                        self.replay_current_video()
-                    elif event.ui_element.text == 'Back' and self.node_history:
-                        self.go_back_to_previous_node()
-                        continue  # Add this line to skip the rest
-                    else:
-                        button_text = event.ui_element.text
-                        if button_text in self.current_node.choices:
-                            self.set_game_state(self.current_node.choices[button_text])
-
-            self.ui_manager.update(time_delta)
-
-            if not self.video_played and self.current_node.media_path:
+            events = pygame.event.get()
+        tick_started = time.perf_counter()
+
+        for event in events:
+            if event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE):
+                self.needs_redraw = True
+
+            if event.type == pygame.QUIT:
+                self.game_is_running = False
+
+            if event.type == pygame.VIDEORESIZE:
+                # Resize event: Update screen and UI manager resolution
+                self.screen_width, self.screen_height = event.size
+                self.screen = pygame.display.set_mode((self.screen_width, self.screen_height), pygame.RESIZABLE)
+                self.ui_manager.set_window_resolution((self.screen_width, self.screen_height))
+                self.player.resize((self.screen_width, self.screen_height))
+                self.prefetcher.resize((self.screen_width, self.screen_height))
+                self.memory_budget.resize((self.screen_width, self.screen_height))
+                self.needs_redraw = True
+
+                # Clear existing UI and show choices if the video has been played
+                if self.video_played:
+                    self.ui_manager.clear_and_reset()
+                    self.show_choices(self.current_node.choices)
+
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
+                # Skip straight to the end of the running clip
+                self.player.skip()
+
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.overlay.toggle()
+                self.needs_redraw = True
+
+                # Handle other events
+            self.ui_manager.process_events(event)
+
+            if event.type == pygame_gui.UI_BUTTON_PRESSED:
+                if event.ui_element.text == 'Replay':
+                    self.replay_current_video()
+                elif event.ui_element.text == 'Back' and self.node_history:
+                    self.go_back_to_previous_node()
+                    continue  # Add this line to skip the rest
+                else:
+                    self.choose(event.ui_element.text)
+
+        self.ui_manager.update(time_delta)
+
+        if self.current_node.is_video and not self.video_played and self.current_node.media_path:
+            if self.player.state != VideoPlayer.STOPPED:
+                self.update_video_playback()
+            else:
                 self.display_media(self.current_node.media_path, self.current_node.is_video)
-            elif self.video_played and self.last_frame and self.current_node.is_video:
-                resized_last_frame = pygame.transform.scale(self.last_frame, (self.screen_width, self.screen_height))
-                self.screen.blit(resized_last_frame, (0, 0))
-                self.ui_manager.draw_ui(self.screen)
-                pygame.display.update()
-
             self.ui_manager.draw_ui(self.screen)
+            self.overlay.draw(self.screen)
+            flip_started = time.perf_counter()
             pygame.display.update()
-
+            flip_seconds = time.perf_counter() - flip_started
+            self.quality_controller.update(time.perf_counter() - tick_started)
+        else:
+            flip_seconds = self.present_still()
+        self.memory_budget.enforce()
+        if (self.checkpoints is not None and self.player.state == VideoPlayer.PLAYING
+                and time.perf_counter() - self.checkpoints.last_saved >= CHECKPOINT_INTERVAL_SECONDS):
+            self.save_checkpoint()
+        if self.startup.first_frame is None and self.first_frame_shown():
+            self.on_first_frame()
+
+        if self.instrumentation.enabled:
+            now = time.perf_counter()
+            self.instrumentation.record('flip', flip_seconds)
+            self.instrumentation.record('tick', now - tick_started)
+            self.instrumentation.record('frame', time_delta)
+            self.record_gauges()
+
+    def first_frame_shown(self):
+        # Image nodes are drawn on their first tick, video nodes once a frame was presented
+        if not self.current_node.is_video:
+            return True
+        return self.player.frame_time is not None or self.video_played
+
+    def on_first_frame(self):
+        self.startup.frame_shown()
+        self.startup.add('first_frame', self.ready_at, self.startup.first_frame, 'MainThread')
+        first_clip = self.first_clip
+        if first_clip is not None and first_clip.opened_at is not None:
+            self.startup.add('first_clip_open', first_clip.prepared_at, first_clip.opened_at, 'prefetch')
+        if self.profile_startup:
+            print(self.startup.report())
+
+    def is_idle(self):
+        return self.awaiting_choice and not self.needs_redraw and not self.overlay.visible
+
+    def present_still(self):
+        # Choice screens: repaint everything only when something marked the screen dirty, otherwise just the
+        # UI rects whose pygame_gui images changed (hover, press). Returns the seconds the display update took.
+        ui_blits = self.ui_manager.ui_group.visible
+        ui_signature = tuple((id(blit[0]), tuple(blit[1])) for blit in ui_blits)
+
+        if self.needs_redraw or self.overlay.visible:
+            backdrop = self.still_backdrop()
+            if backdrop is not None:
+                self.screen.blit(backdrop, (0, 0))
+            self.ui_manager.draw_ui(self.screen)
+            self.overlay.draw(self.screen)
+            update_started = time.perf_counter()
+            pygame.display.update()
+            update_seconds = time.perf_counter() - update_started
+            self.needs_redraw = False
+        elif ui_signature != self.ui_signature:
+            old_rects = [pygame.Rect(rect) for _, rect in (self.ui_signature or ())]
+            dirty_rects = old_rects + [pygame.Rect(blit[1]) for blit in ui_blits]
+            backdrop = self.still_backdrop()
+            for rect in dirty_rects:
+                if backdrop is not None:
+                    self.screen.blit(backdrop, rect, rect)
+            self.ui_manager.draw_ui(self.screen)
+            update_started = time.perf_counter()
+            pygame.display.update(dirty_rects)
+            update_seconds = time.perf_counter() - update_started
+        else:
+            update_seconds = 0.0
+
+        self.ui_signature = ui_signature
+        return update_seconds
+
+    def still_backdrop(self):
+        screen_size = (self.screen_width, self.screen_height)
+        if self.current_node.is_video:
+            # The indexed end-of-clip still is sharper after a resize than rescaling the frame we last showed
+            still = self.media_index.still(self.current_node.media_path, 'last', screen_size)
+            if still is not None:
+                return self.image_cache.get(still, screen_size)
+            last_frame = self.held_frames.get('last_frame')
+            if last_frame is None:
+                return None
+            scaled_last_frame = self.held_frames.get('scaled_last_frame')
+            if scaled_last_frame is None or scaled_last_frame.get_size() != screen_size:
+                # Scaled once per clip and window size instead of every tick
+                scaled_last_frame = pygame.transform.scale(last_frame, screen_size)
+                self.held_frames.hold('scaled_last_frame', scaled_last_frame, self.current_node.media_path, scaled=True)
+            return scaled_last_frame
+        if not self.current_node.media_path:
+            return None
+        return self.image_cache.get(self.current_node.media_path, screen_size)
+
+    def check_media(self):
+        # Report missing files now rather than with sys.exit(1) halfway through a session
+        media = story_media(self.nodes)
+        missing, unindexed = self.media_index.validate(media)
+        for path in missing:
+            print(f"Missing media: {path}")
+        if unindexed:
+            print(f"{len(unindexed)} media files are not in the media index, run preflight.py to index them")
+
+    def record_gauges(self):
+        frame_buffer = self.player.frame_buffer
+        image_lookups = max(1, self.image_cache.hits + self.image_cache.misses)
+        prefetch_lookups = max(1, self.prefetcher.hits + self.prefetcher.misses)
+        audio_lookups = max(1, self.audio_cache.hits + self.audio_cache.misses)
+        self.instrumentation.gauge('queue_depth', len(frame_buffer) if frame_buffer is not None else 0)
+        self.instrumentation.gauge('queue_capacity', self.player.buffer_depth)
+        self.instrumentation.gauge('dropped_frames', self.player.dropped_frames)
+        self.instrumentation.gauge('underruns', self.player.underruns)
+        self.instrumentation.gauge('image_cache_hit_rate', self.image_cache.hits / image_lookups)
+        self.instrumentation.gauge('prefetch_hit_rate', self.prefetcher.hits / prefetch_lookups)
+        self.instrumentation.gauge('audio_cache_hit_rate', self.audio_cache.hits / audio_lookups)
+        self.instrumentation.gauge('quality', self.quality_controller.quality.name)
+        self.instrumentation.gauge('memory_bytes', self.memory_budget.bytes)
+        self.instrumentation.gauge('memory_budget_bytes', self.memory_budget.max_bytes)
+
+    def choose(self, choice_text):
+        if choice_text in self.current_node.choices:
+            self.set_game_state(self.current_node.choices[choice_text])
+
+    @property
+    def awaiting_choice(self):
+        # Image nodes offer their choices right away, video nodes once the clip has played
+        return self.video_played or not self.current_node.is_video
+
+    def shutdown(self):
+        self.save_checkpoint()
+        if self.checkpoints is not None:
+            self.checkpoints.close()
+        self.player.stop()
+        self.prefetcher.cancel()
+        self.audio.close()
+        self.decoder_backend.close()
+        self.instrumentation.close()
         pygame.quit()
-        sys.exit()
 
-    def set_game_state(self, new_node_key, going_back=False):
+    def set_game_state(self, new_node_key, going_back=False, gapless=False):
+        transition_started = time.perf_counter()
         # Store the current node key to history before changing it
         if self.current_node != self.intro_node and not going_back:
-            for key, node in self.nodes.items():
-                if node == self.current_node:
-                    self.node_history.append(key)
-                    break
-
-        node = self.nodes[new_node_key]
-
-        # Check and apply 'set' actions
-        if 'set' in node.state_actions:
-            for state_name, value in node.state_actions['set'].items():
-                self.game_state.set_state(state_name, value)
-
-        # Check and apply 'increase' actions
-        if 'increase' in node.state_actions:
-            for state_name, value in node.state_actions['increase'].items():
-                self.game_state.increase_state(state_name, value)
-
-        # Check and apply 'decrease' actions
-        if 'decrease' in node.state_actions:
-            for state_name, value in node.state_actions['decrease'].items():
-                self.game_state.decrease_state(state_name, value)
-
-        # Check if any node is triggered by the new state values
-        for state_name, value in self.game_state.states.items():
-            for node_key, node in self.nodes.items():
-                if state_name in node.instant_trigger and node.instant_trigger[state_name] == value:
-                    new_node_key = node_key
-                    break
-
-        self.current_node = self.nodes[new_node_key]
+            self.node_history.append(self.current_node.key)
+
+        new_node_key = enter_node(self.game_state, self.nodes, self.trigger_index, new_node_key)
+        new_node = self.nodes[new_node_key]
+        # After a gapless hand-over the player is already playing this node's clip, unless a trigger sent us elsewhere
+        if not (gapless and new_node.is_video and new_node.media_path == self.player.video_path):
+            self.player.stop()
+        self.current_node = new_node
         self.ui_manager.clear_and_reset()
         self.video_played = False
+        self.needs_redraw = True
+        # Going back lands on a node the player can keep walking back from, see show_choices()
+        self.revisiting = going_back
+
+        self.prefetch_next_clips(gapless)
 
         if not self.current_node.is_video:
             # For image nodes, show the choices immediately
             self.show_choices(self.current_node.choices)
+        self.save_checkpoint()
+
+        if self.instrumentation.enabled:
+            self.instrumentation.record('set_game_state', time.perf_counter() - transition_started)
+
+    def prefetch_next_clips(self, gapless=False):
+        # Keep the clip we are entering (if it was prefetched) plus every clip one visible choice away
+        video_paths = []
+        if self.current_node.is_video and self.current_node.media_path:
+            video_paths.append(self.current_node.media_path)
+        for choice_text, node_key in self.current_node.choices.items():
+            node = self.nodes.get(node_key)
+            if node is None or not node.is_video or not node.media_path:
+                continue
+            if self.is_choice_available(choice_text) and node.media_path not in video_paths:
+                video_paths.append(node.media_path)
+        # After a gapless hand-over the player already took the current clip out of the prefetcher and is playing it
+        playing = self.player.video_path if gapless else None
+        self.prefetcher.prefetch([path for path in video_paths if path != playing], self.screen.get_size())
+        self.audio.preload(video_paths)
+        # What is on screen now outranks the choices being prefetched, which outrank anything from earlier nodes
+        current = [self.current_node.media_path]
+        if self.current_node.is_video:
+            current.append(self.media_index.still(self.current_node.media_path, 'last', self.screen.get_size()))
+        self.memory_budget.set_priorities([path for path in current if path], video_paths)
+
+    def is_choice_available(self, choice_text):
+        return is_choice_available(self.current_node, choice_text, self.game_state.states)
             
     def show_choices(self, choices):
         button_y = self.screen_height - 100
         button_height = 50
         x_start = 10  # Startposition für Buttons
+        button_width = 200
 
         for choice_text in choices:
-            show_button = True
-
-            if choice_text in self.current_node.conditions:
-                condition_params = self.current_node.conditions[choice_text]
-                if len(condition_params) == 3:
-                    state_name, operator, value = condition_params
-                    if operator == '==':
-                        condition_func = lambda: self.game_state.get_state(state_name) == value
-                    elif operator == '>':
-                        condition_func = lambda: self.game_state.get_state(state_name) > value
-                    elif operator == '<':
-                        condition_func = lambda: self.game_state.get_state(state_name) < value
-                    else:
-                        raise ValueError(f'Invalid operator: {operator}')
-                    show_button = condition_func()
-
-            if show_button:
-                button_width = 200
+            if self.is_choice_available(choice_text):
                 pygame_gui.elements.UIButton(
                     relative_rect=pygame.Rect((x_start, button_y), (button_width, button_height)),
                     text=choice_text,
@@ -201,8 +463,9 @@ class Game:
                 )
                 x_start += button_width + 10
 
-        # Add "Replay" and "Back" buttons if there are multiple choices
-        if len(choices) > 1:
+        # Add "Replay" and "Back" buttons if there are multiple choices, or the player came back here; a
+        # single-choice node would otherwise advance on its own (or offer only the way forward)
+        if len(choices) > 1 or self.revisiting:
             pygame_gui.elements.UIButton(
                 relative_rect=pygame.Rect((x_start, button_y), (button_width, button_height)),
                 text='Replay',
@@ -223,62 +486,94 @@ class Game:
         self.ui_manager.update(0)
 
     def play_video_clip(self, video_path):
+        # Only starts the clip; Game.run advances it once per tick through update_video_playback
         try:
-            clip = VideoFileClip(video_path)
-
-            if clip.audio is not None:
-                audio_thread = threading.Thread(target=lambda: clip.audio.preview())
-                audio_thread.start()
-            else:
-                audio_thread = None
-
-            for frame in clip.iter_frames(fps=60, dtype='uint8'):
-                screen_size = self.screen.get_size()
-
-                frame_surface = pygame.image.frombuffer(frame.tostring(), frame.shape[1::-1], "RGB")
-                frame_surface = pygame.transform.scale(frame_surface, screen_size)
-                self.screen.blit(frame_surface, (0, 0))
-                pygame.display.flip()
-
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT:
-                        sys.exit()
-                    elif event.type == pygame.VIDEORESIZE:
-                        self.screen_width, self.screen_height = event.size
-                        self.screen = pygame.display.set_mode((self.screen_width, self.screen_height), pygame.RESIZABLE)
-                        self.ui_manager.set_window_resolution((self.screen_width, self.screen_height))
-
-                self.clock.tick(60)
-
-            self.last_frame = frame_surface  # Store the last frame as a surface
-            clip.close()
-            if audio_thread:
-                audio_thread.join()
-            self.video_played = True
-            if len(self.current_node.choices) == 1:
-                next_node_key = list(self.current_node.choices.values())[0]
-                self.set_game_state(next_node_key)
-            elif len(self.current_node.choices) > 0:
-                self.show_choices(self.current_node.choices)
-
+            self.player.play(video_path, self.screen.get_size())
+        except Exception as e:
+            print(f"An error occurred during video playback: {e}")
+            self.player.stop()
+            sys.exit(1)
 
+    def update_video_playback(self):
+        # A node reached through Back waits for a choice at the end of its clip, so nothing is handed over from it
+        next_node_key = None if self.revisiting else self.gapless_successors.get(self.current_node.key)
+        remaining = self.player.remaining
+        try:
+            if next_node_key is not None and remaining is not None and remaining < GAPLESS_PREROLL_SECONDS:
+                # Only takes a clip that is already prepared; otherwise this one ends normally
+                self.player.queue(self.nodes[next_node_key].media_path, self.screen.get_size())
+            frame_surface = self.player.update(self.screen.get_size())
         except Exception as e:
             print(f"An error occurred during video playback: {e}")
+            self.player.stop()
             sys.exit(1)
+
+        if self.player.handed_over:
+            # The player moved on to the next clip of the chain by itself; catch the game state up with it
+            self.player.handed_over = False
+            self.set_game_state(next_node_key, gapless=True)
+
+        if frame_surface is not None:
+            if frame_surface.get_size() != self.screen.get_size():
+                # Only happens for frames decoded before a resize
+                scale_started = time.perf_counter()
+                frame_surface = pygame.transform.scale(frame_surface, self.screen.get_size())
+                if self.instrumentation.enabled:
+                    self.instrumentation.record('scale', time.perf_counter() - scale_started)
+            blit_started = time.perf_counter()
+            self.screen.blit(frame_surface, (0, 0))
+            if self.instrumentation.enabled:
+                self.instrumentation.record('blit', time.perf_counter() - blit_started)
+
+        if self.player.state == VideoPlayer.FINISHED:
+            self.on_video_finished()
+
+    def on_video_finished(self):
+        # Keep the last frame as the backdrop of the choice screen
+        self.held_frames.hold('last_frame', self.player.frame_surface, self.current_node.media_path)
+        self.held_frames.drop('scaled_last_frame')
+        self.needs_redraw = True
+        self.video_played = True
+        if len(self.current_node.choices) == 1 and not self.revisiting:
+            next_node_key = list(self.current_node.choices.values())[0]
+            self.set_game_state(next_node_key)
+        elif len(self.current_node.choices) > 0:
+            self.show_choices(self.current_node.choices)
+        dropped_frames, underruns, max_drift = self.player.clip_stats
+        print(f"Playback of {self.current_node.media_path}: {dropped_frames} dropped frames, {underruns} underruns, "
+              f"max drift {max_drift * 1000:.1f} ms")
         #print all gamestates and their values
         print(self.game_state.states)
+        self.save_checkpoint()
 
     def replay_current_video(self):
         # Play the video again
         self.video_played = False
-        self.display_media(self.current_node.media_path, self.current_node.is_video)
+        self.needs_redraw = True
+        self.ui_manager.clear_and_reset()
+        if self.current_node.is_video:
+            self.player.replay(self.current_node.media_path)
+        else:
+            self.display_media(self.current_node.media_path, self.current_node.is_video)
 
     def go_back_to_previous_node(self):
         if self.node_history:
             previous_node_key = self.node_history.pop()  # Pop the last node key from the history
             self.set_game_state(previous_node_key, going_back=True)
             self.video_played = False
-            self.play_video_clip(self.current_node.media_path)
+            if self.current_node.is_video:
+                if self.media_index.still(self.current_node.media_path, 'last', self.screen.get_size()) is not None:
+                    # Straight back to the choice screen over the clip's last frame; Replay plays it in full
+                    self.show_end_of_clip()
+                else:
+                    self.player.go_back(self.current_node.media_path)
+
+    def show_end_of_clip(self):
+        self.held_frames.drop('last_frame')
+        self.held_frames.drop('scaled_last_frame')
+        self.video_played = True
+        self.needs_redraw = True
+        self.show_choices(self.current_node.choices)
 
     def check_for_special_conditions(self):
         # Check for specific conditions to modify gameplay
@@ -288,17 +583,37 @@ class Game:
                 self.current_node.choices['Secret Choice'] = 'secret_node'
 
     def display_media(self, media_path, is_video):
+        display_started = time.perf_counter()
         if is_video:
             self.play_video_clip(media_path)
         else:
-            # Logic for displaying a picture
-            picture = pygame.image.load(media_path)
-            picture = pygame.transform.scale(picture, (self.screen_width, self.screen_height))
+            # Logic for displaying a picture, decoded and scaled once per window size
+            picture = self.image_cache.get(media_path, (self.screen_width, self.screen_height))
             self.screen.blit(picture, (0, 0))
             self.ui_manager.draw_ui(self.screen)
             pygame.display.flip()
+        if self.instrumentation.enabled:
+            self.instrumentation.record('display_media', time.perf_counter() - display_started)
 
 
 if __name__ == '__main__':
-    game = Game()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trace', help='write per-stage timings to this .jsonl or .csv file (F3 toggles the overlay)')
+    parser.add_argument('--decoder', choices=sorted(BACKENDS), help='video decoder backend (default: pyav if installed)')
+    parser.add_argument('--quality', choices=list(QUALITY_LEVELS),
+                        help='pin playback to this quality level instead of adapting it to the machine')
+    parser.add_argument('--quality-log', help='append every automatic quality change to this .jsonl file')
+    parser.add_argument('--memory-budget', type=int, default=MEMORY_BUDGET_BYTES // (1024 * 1024),
+                        help='megabytes all media caches may use together')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print where the time to the first frame went, phase by phase')
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PATH,
+                        help='file the session is saved to on every transition and every few seconds')
+    parser.add_argument('--resume', action='store_true',
+                        help='carry on from the saved session, mid-clip if it was saved during one')
+    args = parser.parse_args()
+
+    game = Game(instrumentation=Instrumentation([TraceFile(args.trace)]) if args.trace else None, decoder=args.decoder,
+                quality=args.quality, quality_log=args.quality_log, memory_budget=args.memory_budget * 1024 * 1024,
+                profile_startup=args.profile_startup, checkpoint_path=args.checkpoint, resume=args.resume)
     game.run()
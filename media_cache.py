@@ -0,0 +1,346 @@
+import threading
+import time
+from collections import OrderedDict
+
+import pygame
+
+IMAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Raw 720p RGB is ~2.7 MB a frame, so this holds roughly 13 s of 30 fps video
+CLIP_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+# 16 bit stereo at 44.1 kHz is ~10 MB a minute
+AUDIO_CACHE_MAX_BYTES = 128 * 1024 * 1024
+# Everything the caches, prefetched clips and held frames may use together
+MEMORY_BUDGET_BYTES = 1024 * 1024 * 1024
+
+# Eviction order under the MemoryBudget: history goes first, then prefetched choices; the current node's media is
+# never evicted
+HISTORY = 0
+PREFETCH = 1
+CURRENT = 2
+
+
+def surface_nbytes(surface):
+    return surface.get_pitch() * surface.get_height()
+
+
+class ImageCache:
+    """LRU cache of decoded, convert()ed image surfaces keyed by (path, target size).
+
+    The unscaled source is stored under (path, None) so a resize only has to rescale, not reload.
+    """
+
+    def __init__(self, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.surfaces = OrderedDict()
+        self.last_used = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path, size):
+        key = (path, tuple(size))
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.last_used[key] = time.perf_counter()
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        source = self.surfaces.get((path, None))
+        if source is None:
+            source = pygame.image.load(path).convert()
+            self._store((path, None), source)
+        else:
+            self.surfaces.move_to_end((path, None))
+            self.last_used[(path, None)] = time.perf_counter()
+
+        if source.get_size() == key[1]:
+            return source
+        surface = pygame.transform.scale(source, key[1])
+        self._store(key, surface)
+        return surface
+
+    def invalidate_size(self, size):
+        # Scaled variants for any other window size won't be asked for again; sources stay for rescaling
+        for key in [key for key in self.surfaces if key[1] is not None and key[1] != tuple(size)]:
+            self._remove(key)
+
+    def clear(self):
+        self.surfaces.clear()
+        self.last_used.clear()
+        self.bytes = 0
+
+    def entries(self):
+        return [(key, key[0], surface_nbytes(surface), self.last_used[key]) for key, surface in self.surfaces.items()]
+
+    def evict(self, key):
+        if key in self.surfaces:
+            self._remove(key)
+            self.evictions += 1
+
+    def _store(self, key, surface):
+        if key in self.surfaces:
+            self._remove(key)
+        self.surfaces[key] = surface
+        self.last_used[key] = time.perf_counter()
+        self.bytes += surface_nbytes(surface)
+        # Never evict the entry we just stored, even if it alone exceeds the budget
+        while self.bytes > self.max_bytes and len(self.surfaces) > 1:
+            oldest = next(iter(self.surfaces))
+            if oldest == key:
+                break
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        surface = self.surfaces.pop(key)
+        del self.last_used[key]
+        self.bytes -= surface_nbytes(surface)
+
+
+class CachedClipFrames:
+    def __init__(self, video_path, size, frames):
+        self.video_path = video_path
+        self.size = size
+        self.frames = frames
+        self.bytes = sum(frame.nbytes for _, frame in frames)
+        self.last_used = time.perf_counter()
+
+
+class ClipFrameCache:
+    """LRU cache of fully decoded clips (timestamped RGB arrays at window size) for Replay and Back.
+
+    Clips are cached whole or not at all; one that doesn't fit the budget is simply decoded again next time.
+    """
+
+    def __init__(self, max_bytes=CLIP_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.clips = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, video_path, size):
+        cached = self.clips.get(video_path)
+        if cached is None or cached.size != tuple(size):
+            self.misses += 1
+            return None
+        self.clips.move_to_end(video_path)
+        cached.last_used = time.perf_counter()
+        self.hits += 1
+        return cached
+
+    def contains(self, video_path, size):
+        cached = self.clips.get(video_path)
+        return cached is not None and cached.size == tuple(size)
+
+    def store(self, video_path, size, frames):
+        cached = CachedClipFrames(video_path, tuple(size), frames)
+        if cached.bytes > self.max_bytes:
+            return
+        if video_path in self.clips:
+            self._remove(video_path)
+        while self.clips and self.bytes + cached.bytes > self.max_bytes:
+            self._remove(next(iter(self.clips)))
+            self.evictions += 1
+        self.clips[video_path] = cached
+        self.bytes += cached.bytes
+
+    def invalidate_size(self, size):
+        # Frames are stored at window size, so a resize makes every other size useless
+        for video_path in [path for path, cached in self.clips.items() if cached.size != tuple(size)]:
+            self._remove(video_path)
+
+    def clear(self):
+        self.clips.clear()
+        self.bytes = 0
+
+    def entries(self):
+        return [(video_path, video_path, cached.bytes, cached.last_used) for video_path, cached in self.clips.items()]
+
+    def evict(self, video_path):
+        if video_path in self.clips:
+            self._remove(video_path)
+            self.evictions += 1
+
+    def _remove(self, video_path):
+        self.bytes -= self.clips.pop(video_path).bytes
+
+
+class AudioCache:
+    """LRU cache of decoded clip audio per media_path, as WAV images of 16 bit PCM ready for pygame.mixer.
+
+    Silent clips are stored as empty bytes so they are not probed again. The audio worker stores while the game
+    thread reads, hence the lock.
+    """
+
+    def __init__(self, max_bytes=AUDIO_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.clips = OrderedDict()
+        self.last_used = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, video_path):
+        with self.lock:
+            wav = self.clips.get(video_path)
+            if wav is None:
+                self.misses += 1
+                return None
+            self.clips.move_to_end(video_path)
+            self.last_used[video_path] = time.perf_counter()
+            self.hits += 1
+            return wav
+
+    def contains(self, video_path):
+        with self.lock:
+            return video_path in self.clips
+
+    def store(self, video_path, wav):
+        with self.lock:
+            if len(wav) > self.max_bytes:
+                return
+            if video_path in self.clips:
+                self._remove(video_path)
+            while self.clips and self.bytes + len(wav) > self.max_bytes:
+                self._remove(next(iter(self.clips)))
+                self.evictions += 1
+            self.clips[video_path] = wav
+            self.last_used[video_path] = time.perf_counter()
+            self.bytes += len(wav)
+
+    def clear(self):
+        with self.lock:
+            self.clips.clear()
+            self.last_used.clear()
+            self.bytes = 0
+
+    def entries(self):
+        with self.lock:
+            return [(video_path, video_path, len(wav), self.last_used[video_path])
+                    for video_path, wav in self.clips.items()]
+
+    def evict(self, video_path):
+        with self.lock:
+            if video_path in self.clips:
+                self._remove(video_path)
+                self.evictions += 1
+
+    def _remove(self, video_path):
+        del self.last_used[video_path]
+        self.bytes -= len(self.clips.pop(video_path))
+
+
+class HeldSurfaces:
+    """Named surfaces the game keeps on screen between clips (the last frame and its scaled copy), so the memory
+    budget can count them and drop them once their node is history."""
+
+    def __init__(self):
+        # name -> (surface, media_path, scaled, last_used)
+        self.surfaces = {}
+        self.bytes = 0
+        self.evictions = 0
+
+    def hold(self, name, surface, media_path=None, scaled=False):
+        self.drop(name)
+        if surface is not None:
+            self.surfaces[name] = (surface, media_path, scaled, time.perf_counter())
+            self.bytes += surface_nbytes(surface)
+
+    def get(self, name):
+        held = self.surfaces.get(name)
+        return held[0] if held is not None else None
+
+    def drop(self, name):
+        held = self.surfaces.pop(name, None)
+        if held is not None:
+            self.bytes -= surface_nbytes(held[0])
+
+    def invalidate_size(self, size):
+        for name in [name for name, held in self.surfaces.items() if held[2] and held[0].get_size() != tuple(size)]:
+            self.drop(name)
+
+    def entries(self):
+        return [(name, media_path, surface_nbytes(surface), last_used)
+                for name, (surface, media_path, _, last_used) in self.surfaces.items()]
+
+    def evict(self, name):
+        if name in self.surfaces:
+            self.drop(name)
+            self.evictions += 1
+
+
+class MemoryBudget:
+    """One byte budget over every media cache in the game, enforced by priority and then least recent use.
+
+    A registered cache exposes `bytes` (and optionally `hits`, `misses` and `evictions`), lists what it could give
+    up as (key, media_path, nbytes, last_used) from entries() and gives it up with evict(key). Entries of the current
+    node's media outrank those of prefetched choices, which outrank everything else. enforce() runs on the game
+    thread, so caches filled from worker threads never have entries pulled from under the game.
+    """
+
+    def __init__(self, max_bytes=MEMORY_BUDGET_BYTES):
+        self.max_bytes = max_bytes
+        self.caches = {}
+        self.current = set()
+        self.prefetch = set()
+        self.evictions = 0
+
+    def register(self, name, cache):
+        # No single cache may hold more than the whole budget; their stores refuse anything larger than max_bytes,
+        # and the player and prefetcher record clips for the frame cache only up to its max_bytes
+        if hasattr(cache, 'max_bytes'):
+            cache.max_bytes = min(cache.max_bytes, self.max_bytes)
+        self.caches[name] = cache
+        return cache
+
+    def set_priorities(self, current=(), prefetch=()):
+        self.current = set(current)
+        self.prefetch = set(prefetch)
+
+    def priority(self, media_path):
+        if media_path in self.current:
+            return CURRENT
+        if media_path in self.prefetch:
+            return PREFETCH
+        return HISTORY
+
+    @property
+    def bytes(self):
+        return sum(cache.bytes for cache in self.caches.values())
+
+    def enforce(self):
+        """Evicts until the caches fit the budget again, or only current entries are left. Returns the bytes freed."""
+        over = self.bytes - self.max_bytes
+        if over <= 0:
+            return 0
+        candidates = [(self.priority(media_path), last_used, name, key, nbytes)
+                      for name, cache in self.caches.items()
+                      for key, media_path, nbytes, last_used in cache.entries()]
+        candidates.sort(key=lambda candidate: candidate[:2])
+        freed = 0
+        for priority, _, name, key, nbytes in candidates:
+            if freed >= over or priority == CURRENT:
+                break
+            self.caches[name].evict(key)
+            self.evictions += 1
+            freed += nbytes
+        return freed
+
+    def resize(self, size):
+        # Scaled variants for the old window size are dead weight now
+        for cache in self.caches.values():
+            if hasattr(cache, 'invalidate_size'):
+                cache.invalidate_size(size)
+
+    def stats(self):
+        caches = {name: {'bytes': cache.bytes, 'hits': getattr(cache, 'hits', 0),
+                         'misses': getattr(cache, 'misses', 0), 'evictions': getattr(cache, 'evictions', 0)}
+                  for name, cache in self.caches.items()}
+        return {'max_bytes': self.max_bytes, 'bytes': self.bytes, 'evictions': self.evictions, 'caches': caches}
@@ -0,0 +1,119 @@
+import bisect
+import hashlib
+import json
+import os
+
+import pygame
+
+from decoders import create_backend
+from utils import closest_size, file_signature
+
+# Sidecar index of probed media metadata, plus the poster and last frame of every clip
+MEDIA_INDEX_DIR = 'assets/media_index'
+INDEX_FILE = 'index.json'
+# Window sizes the poster and last frame are stored at, besides the clip's own size
+STILL_RESOLUTIONS = [(1280, 720), (1920, 1080)]
+
+
+def still_file(path, which, size, index_dir=MEDIA_INDEX_DIR):
+    digest = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]
+    width, height = size
+    return os.path.join(index_dir, f'{digest}_{which}_{width}x{height}.png')
+
+
+def save_stills(path, which, array, index_dir=MEDIA_INDEX_DIR):
+    # Writes the frame at its own size and every STILL_RESOLUTIONS size; returns {'WxH': filename}.
+    # pygame can scale and write images without a display
+    surface = pygame.image.frombuffer(array.tobytes(), array.shape[1::-1], 'RGB')
+    stills = {}
+    for size in dict.fromkeys([surface.get_size(), *STILL_RESOLUTIONS]):
+        filename = still_file(path, which, size, index_dir)
+        scaled = surface if size == surface.get_size() else pygame.transform.smoothscale(surface, size)
+        pygame.image.save(scaled, filename)
+        stills['{}x{}'.format(*size)] = filename
+    return stills
+
+
+def index_media(path, is_video, index_dir=MEDIA_INDEX_DIR, decoder=None):
+    """Probes one media file and writes its poster and last frame. Runs in a preflight.py worker process."""
+    entry = {'path': path, 'is_video': is_video, 'signature': list(file_signature(path))}
+    if is_video:
+        backend = create_backend(decoder)
+        entry.update(backend.probe(path))
+        first, last = backend.end_frames(path)
+        entry['stills'] = {'poster': save_stills(path, 'poster', first, index_dir),
+                           'last': save_stills(path, 'last', last, index_dir)}
+        # Where a resumed clip can start decoding without first decoding and dropping frames
+        entry['keyframes'] = [round(t, 6) for t in backend.keyframes(path)]
+        backend.close()
+    else:
+        width, height = pygame.image.load(path).get_size()
+        entry.update({'width': width, 'height': height})
+    return entry
+
+
+class MediaIndex:
+    """Probed metadata per media_path, trusted only while the file's mtime and size still match."""
+
+    def __init__(self, index_dir=MEDIA_INDEX_DIR):
+        self.index_dir = index_dir
+        self.entries = {}
+        try:
+            with open(os.path.join(index_dir, INDEX_FILE), 'r') as file:
+                self.entries = json.load(file)
+        except (OSError, ValueError):
+            pass
+
+    def get(self, path):
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        try:
+            signature = list(file_signature(path))
+        except OSError:
+            return None
+        if entry.get('signature') != signature:
+            return None
+        return entry
+
+    def store(self, entry):
+        self.entries[entry['path']] = entry
+
+    def save(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        filename = os.path.join(self.index_dir, INDEX_FILE)
+        with open(filename + '.tmp', 'w') as file:
+            json.dump(self.entries, file, indent=1)
+        os.replace(filename + '.tmp', filename)
+
+    def has_audio(self, path):
+        # None when unknown, so callers fall back to probing
+        entry = self.get(path)
+        return entry.get('audio') if entry is not None else None
+
+    def still(self, path, which, size):
+        """Returns the file of the clip's 'poster' or 'last' frame best suited to this window size, or None."""
+        entry = self.get(path)
+        stills = entry.get('stills', {}).get(which) if entry is not None else None
+        if not stills:
+            return None
+        sizes = {tuple(int(value) for value in key.split('x')): filename for key, filename in stills.items()}
+        filename = sizes[closest_size(sizes, size)]
+        return filename if os.path.exists(filename) else None
+
+    def keyframe_before(self, path, position):
+        """Returns the timestamp of the last keyframe at or before `position`, or None if the clip's are unknown."""
+        entry = self.get(path)
+        keyframes = entry.get('keyframes') if entry is not None else None
+        if not keyframes:
+            return None
+        index = bisect.bisect_right(keyframes, position)
+        return keyframes[index - 1] if index else keyframes[0]
+
+    def validate(self, media):
+        """Returns (missing, unindexed) media paths out of `media`."""
+        missing = [path for path in media if not os.path.exists(path)]
+        # Clips indexed before keyframes were recorded count as unindexed, so preflight.py probes them again
+        unindexed = [path for path in media if path not in missing and
+                     (self.get(path) is None or media[path] and 'keyframes' not in self.get(path))]
+        return missing, unindexed
@@ -0,0 +1,770 @@
+import threading
+import time
+from collections import deque
+
+import pygame
+
+from decoders import create_backend
+from frame_store import FrameStore, find_store
+from instrumentation import Instrumentation
+from quality import FULL_QUALITY
+
+# Decode-ahead limits for the frame buffer between the decoder thread and the render loop
+FRAME_BUFFER_DEPTH = 30
+FRAME_BUFFER_MAX_BYTES = 256 * 1024 * 1024
+# Frames pre-decoded for each clip the player might pick next
+PREFETCH_FRAMES = 10
+# How far the wall clock may wander from the mixer's position before it is pulled back onto the audio
+AUDIO_RESYNC_SECONDS = 0.04
+# How long a clip whose frames are ready waits for its audio before it starts without sound
+AUDIO_WAIT_SECONDS = 2.0
+
+
+class FrameBuffer:
+    def __init__(self, max_frames=FRAME_BUFFER_DEPTH, max_bytes=FRAME_BUFFER_MAX_BYTES):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.frames = deque()
+        self.bytes = 0
+        self.underruns = 0
+        self.finished = False
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def is_full(self, nbytes=0):
+        # Always accept at least one frame so a single huge frame can't deadlock the decoder
+        if not self.frames:
+            return False
+        return len(self.frames) >= self.max_frames or self.bytes + nbytes > self.max_bytes
+
+    def put(self, timestamp, frame, nbytes, stop_event):
+        # Blocks the producer while the buffer is full; returns False if playback was stopped meanwhile
+        with self.condition:
+            while self.is_full(nbytes) and not stop_event.is_set():
+                self.condition.wait(0.05)
+            if stop_event.is_set():
+                return False
+            self.frames.append((timestamp, frame, nbytes))
+            self.bytes += nbytes
+            self.condition.notify_all()
+            return True
+
+    def pop_due(self, now):
+        """Returns (timestamp, frame) of the newest frame due at `now` and the list of older due frames it supersedes.
+
+        Never blocks the render loop: an empty buffer mid-clip counts as an underrun.
+        """
+        with self.condition:
+            if not self.frames:
+                if not self.finished:
+                    self.underruns += 1
+                return None, []
+
+            due = []
+            while self.frames and self.frames[0][0] <= now:
+                timestamp, frame, nbytes = self.frames.popleft()
+                self.bytes -= nbytes
+                due.append((timestamp, frame))
+            if due:
+                self.condition.notify_all()
+                return due[-1], [frame for _, frame in due[:-1]]
+            return None, []
+
+    def set_max_frames(self, max_frames):
+        with self.condition:
+            self.max_frames = max_frames
+            self.condition.notify_all()
+
+    def finish(self):
+        with self.condition:
+            self.finished = True
+            self.condition.notify_all()
+
+    def clear(self):
+        with self.condition:
+            self.frames.clear()
+            self.bytes = 0
+            self.condition.notify_all()
+
+    @property
+    def exhausted(self):
+        return self.finished and not self.frames
+
+
+class SurfacePool:
+    """Reusable frame surfaces in the display's pixel format, so the screen blit is a plain copy.
+
+    The decoder acquires a surface per frame and the render loop releases it once a newer frame replaced it.
+    """
+
+    def __init__(self):
+        self.free = []
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.allocations = 0
+        self.allocated_bytes = 0
+
+    def acquire(self, size):
+        with self.lock:
+            self.frames += 1
+            while self.free:
+                surface = self.free.pop()
+                if surface.get_size() == size:
+                    return surface
+                # Left over from before a resize, let it go
+        return self.allocate(size)
+
+    def allocate(self, size):
+        display = pygame.display.get_surface()
+        surface = pygame.Surface(size, 0, display) if display is not None else pygame.Surface(size)
+        self.count_allocation(surface)
+        return surface
+
+    def count_allocation(self, surface):
+        with self.lock:
+            self.allocations += 1
+            self.allocated_bytes += surface.get_pitch() * surface.get_height()
+
+    def release(self, surface):
+        with self.lock:
+            self.free.append(surface)
+
+    @property
+    def bytes_per_frame(self):
+        return self.allocated_bytes / self.frames if self.frames else 0
+
+
+class PresentationClock:
+    """Playback position in seconds, started together with the clip's audio (or on the first frame if it has none).
+
+    The wall clock keeps frame pacing smooth; with audio attached it is pulled back onto the mixer's position
+    whenever the two drift apart, since the mixer's position only moves in whole audio buffers.
+    """
+
+    def __init__(self, offset=0.0):
+        self.started_at = None
+        self.audio = None
+        # Where in the file the clip was opened; the mixer reports positions in the whole file
+        self.offset = offset
+
+    def start(self, audio=None):
+        self.started_at = time.perf_counter()
+        self.audio = audio
+
+    @property
+    def running(self):
+        return self.started_at is not None
+
+    def time(self):
+        now = time.perf_counter()
+        if self.audio is not None:
+            position = self.audio.position()
+            if position is not None:
+                position -= self.offset
+            if position is not None and abs(now - self.started_at - position) > AUDIO_RESYNC_SECONDS:
+                self.started_at = now - position
+        return now - self.started_at
+
+
+def open_clip(video_path, size, backend, quality=FULL_QUALITY, start=0.0):
+    # A clip baked by bake.py is streamed straight from mmap with no decoder at all, whatever the quality
+    store = find_store(video_path, size)
+    if store is not None:
+        return FrameStore(store, start)
+    return backend.open(video_path, quality.decode_size(size), start=start, quality=quality)
+
+
+class CachedClip:
+    """Stands in for a VideoFileClip whose frames come from the ClipFrameCache instead of ffmpeg."""
+
+    def __init__(self, cached):
+        self.cached = cached
+        self.filename = cached.video_path
+        self.duration = cached.frames[-1][0] if cached.frames else 0
+
+    def iter_frames(self, with_times=True, dtype='uint8'):
+        for t, frame in self.cached.frames:
+            yield (t, frame) if with_times else frame
+
+    def close(self):
+        pass
+
+
+class FrameDecoder(threading.Thread):
+    """Decodes a clip on a background thread and fills a FrameBuffer with ready-to-blit surfaces.
+
+    With a record_limit, the decoded arrays are also kept (up to that many bytes) so the whole clip can be cached.
+    Setting `quality` (a quality.QualityLevel) or `size` from another thread takes effect from the next frame.
+    Timestamps count from the clip's start, which is `offset` seconds into the file for a resumed clip.
+    """
+
+    def __init__(self, clip, size, frame_buffer, instrumentation=None, record_limit=0, backend=None,
+                 quality=FULL_QUALITY, offset=0.0):
+        super().__init__(daemon=True)
+        self.clip = clip
+        self.offset = offset
+        self.backend = backend or create_backend()
+        self.size = size
+        self.quality = quality
+        self.frame_buffer = frame_buffer
+        self.instrumentation = instrumentation or Instrumentation()
+        self.surface_pool = SurfacePool()
+        self.stop_event = threading.Event()
+        self.error = None
+        self.completed = False
+        self.record_limit = record_limit
+        # Baked clips are already a zero-decode source, so they are not worth memory in the frame cache, frames
+        # below full quality would stay degraded on every replay, and a resumed clip lacks its beginning
+        cacheable = not isinstance(clip, FrameStore) and quality is FULL_QUALITY and not offset
+        # A clip that can't fit is not recorded at all, rather than holding frames until it runs out of room
+        cacheable = cacheable and self.estimated_bytes(clip, size) <= record_limit
+        self.recording = [] if record_limit and cacheable else None
+        self.recording_bytes = 0
+        # Seconds spent decoding, scaling and converting, for the QualityController's decoder load
+        self.busy_seconds = 0.0
+
+    def run(self):
+        clip = self.clip
+        start = 0.0
+        try:
+            while clip is not None:
+                restart_at = self.decode(clip, start)
+                if clip is not self.clip:
+                    clip.close()
+                clip = None
+                if restart_at is not None and restart_at < self.clip.duration:
+                    # The window was resized or the quality changed: reopen and carry on from the same timestamp
+                    start = restart_at
+                    clip = open_clip(self.clip.filename, self.size, self.backend, self.quality, self.offset + start)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.frame_buffer.finish()
+
+    def decode(self, clip, start):
+        # Returns the timestamp to restart from if the target size or quality needs the clip reopened, otherwise None
+        output_size = self.size
+        quality = self.quality
+        if hasattr(clip, 'configure'):
+            # The quality may have changed between opening the clip and starting to decode it
+            clip.configure(quality.decode_size(output_size), quality)
+        frame_step = self.frame_step(clip, quality)
+        instrumentation = self.instrumentation
+        # Native frame rate: each frame is decoded once and presented at its own timestamp
+        frames = clip.iter_frames(with_times=True, dtype='uint8')
+        index = -1
+        while True:
+            decode_started = time.perf_counter()
+            try:
+                t, frame = next(frames)
+            except StopIteration:
+                self.completed = True
+                return None
+            decode_seconds = time.perf_counter() - decode_started
+            self.busy_seconds += decode_seconds
+            if instrumentation.enabled:
+                instrumentation.record('decode', decode_seconds)
+            if self.stop_event.is_set():
+                return None
+            if self.size != output_size:
+                # Frames of two sizes can't be cached as one clip
+                self.recording = None
+                return start + t
+            if self.quality is not quality:
+                # Nor frames of two qualities
+                self.recording = None
+                if hasattr(clip, 'configure'):
+                    clip.configure(self.quality.decode_size(output_size), self.quality)
+                elif (not isinstance(clip, (CachedClip, FrameStore))
+                      and self.quality.decode_size(output_size) != quality.decode_size(output_size)):
+                    # moviepy's ffmpeg process keeps the size it was started with
+                    return start + t
+                quality = self.quality
+                frame_step = self.frame_step(clip, quality)
+            index += 1
+            if index % frame_step:
+                continue
+
+            if self.recording is not None:
+                # Backends hand out a fresh array per frame, so keeping a reference costs no copy
+                self.recording_bytes += frame.nbytes
+                if self.recording_bytes > self.record_limit:
+                    self.recording = None
+                else:
+                    self.recording.append((start + t, frame))
+
+            # Wraps the decoder's array without copying it; the only pixel copy is the blit into a pooled surface
+            source = pygame.image.frombuffer(frame, frame.shape[1::-1], "RGB")
+            if source.get_size() != output_size:
+                # A reduced decode resolution, or a clip baked at another size
+                scale_started = time.perf_counter()
+                source = pygame.transform.scale(source, output_size)
+                self.surface_pool.count_allocation(source)
+                scale_seconds = time.perf_counter() - scale_started
+                self.busy_seconds += scale_seconds
+                if instrumentation.enabled:
+                    instrumentation.record('scale', scale_seconds)
+            convert_started = time.perf_counter()
+            frame_surface = self.surface_pool.acquire(output_size)
+            frame_surface.blit(source, (0, 0))
+            convert_seconds = time.perf_counter() - convert_started
+            self.busy_seconds += convert_seconds
+            if instrumentation.enabled:
+                instrumentation.record('convert', convert_seconds)
+            nbytes = frame_surface.get_pitch() * frame_surface.get_height()
+            if not self.frame_buffer.put(start + t, frame_surface, nbytes, self.stop_event):
+                return None
+
+    @property
+    def recorded_bytes(self):
+        # Frames held for the frame cache while the clip is still decoding
+        return self.recording_bytes if self.recording is not None else 0
+
+    @staticmethod
+    def estimated_bytes(clip, size):
+        # Decoded RGB size of the whole clip at `size`; 0 when its frame rate is unknown, which leaves it to the
+        # record_limit check while decoding
+        fps = getattr(clip, 'fps', None) or 0
+        width, height = size
+        return int(clip.duration * fps + 1) * width * height * 3 if fps else 0
+
+    @staticmethod
+    def frame_step(clip, quality):
+        # PyAV skips frames inside the decoder. Cached and baked clips present every frame_step-th frame, which saves
+        # their scale and convert; moviepy's ffmpeg decodes and pipes every frame anyway, so it presents them all
+        return quality.frame_step if isinstance(clip, (CachedClip, FrameStore)) else 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.frame_buffer.clear()
+
+
+class PreparedClip:
+    """An opened clip whose decoder is already filling its frame buffer, ready to be handed to VideoPlayer."""
+
+    def __init__(self, video_path, size, frame_buffer, instrumentation=None, record_limit=0, backend=None,
+                 quality=FULL_QUALITY):
+        self.video_path = video_path
+        self.size = size
+        self.quality = quality
+        self.frame_buffer = frame_buffer
+        self.instrumentation = instrumentation or Instrumentation()
+        self.record_limit = record_limit
+        self.backend = backend or create_backend()
+        self.clip = None
+        self.decoder = None
+        self.error = None
+        self.cancelled = False
+        self.prepared_at = time.perf_counter()
+        self.opened_at = None
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+
+    def open(self):
+        # Runs on a prefetch thread: opening the clip is the slow probe we want off the game thread
+        try:
+            clip = open_clip(self.video_path, self.size, self.backend, self.quality)
+            self.opened_at = time.perf_counter()
+            with self.lock:
+                if self.cancelled:
+                    clip.close()
+                    return
+                self.clip = clip
+                self.decoder = FrameDecoder(clip, self.size, self.frame_buffer, self.instrumentation,
+                                            self.record_limit, self.backend, self.quality)
+                self.decoder.start()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ready.set()
+
+    @property
+    def bytes(self):
+        decoder = self.decoder
+        return self.frame_buffer.bytes + (decoder.recorded_bytes if decoder is not None else 0)
+
+    def resize(self, size):
+        self.size = size
+        if self.decoder is not None:
+            self.decoder.size = size
+
+    def set_quality(self, quality):
+        with self.lock:
+            self.quality = quality
+            if self.decoder is not None:
+                self.decoder.quality = quality
+
+    def close(self):
+        with self.lock:
+            self.cancelled = True
+            decoder, clip = self.decoder, self.clip
+            self.decoder = self.clip = None
+        if decoder is not None:
+            decoder.stop()
+            decoder.join()
+        if clip is not None:
+            clip.close()
+
+
+class Prefetcher:
+    """Opens the clips of likely next nodes in the background and pre-decodes their first frames."""
+
+    def __init__(self, preroll_frames=PREFETCH_FRAMES, buffer_max_bytes=FRAME_BUFFER_MAX_BYTES,
+                 instrumentation=None, frame_cache=None, backend=None):
+        self.preroll_frames = preroll_frames
+        self.buffer_max_bytes = buffer_max_bytes
+        self.instrumentation = instrumentation or Instrumentation()
+        self.frame_cache = frame_cache
+        self.backend = backend or create_backend()
+        self.quality = FULL_QUALITY
+        self.prepared = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def prefetch(self, video_paths, size):
+        # Anything not in video_paths is a choice the player can no longer take
+        self.cancel(keep=video_paths)
+        record_limit = self.frame_cache.max_bytes if self.frame_cache is not None else 0
+        for video_path in video_paths:
+            if video_path in self.prepared:
+                continue
+            if self.frame_cache is not None and self.frame_cache.contains(video_path, size):
+                # Already decoded in memory, nothing to warm up
+                continue
+            frame_buffer = FrameBuffer(self.preroll_frames, self.buffer_max_bytes)
+            prepared = PreparedClip(video_path, size, frame_buffer, self.instrumentation, record_limit, self.backend,
+                                    self.quality)
+            self.prepared[video_path] = prepared
+            threading.Thread(target=prepared.open, daemon=True).start()
+
+    def take(self, video_path, size, wait=True):
+        # Without wait, a clip still being opened stays prefetched and None is returned, so the caller can ask again
+        prepared = self.prepared.get(video_path)
+        if prepared is None:
+            if wait:
+                self.misses += 1
+            return None
+        if not wait and not prepared.ready.is_set():
+            return None
+        del self.prepared[video_path]
+        # Waiting here is never slower than opening the clip from scratch
+        prepared.ready.wait()
+        if prepared.error is not None or prepared.decoder is None:
+            prepared.close()
+            self.misses += 1
+            return None
+        prepared.resize(size)
+        self.hits += 1
+        return prepared
+
+    def resize(self, size):
+        for prepared in self.prepared.values():
+            prepared.resize(size)
+
+    def set_quality(self, quality):
+        self.quality = quality
+        for prepared in self.prepared.values():
+            prepared.set_quality(quality)
+
+    def cancel(self, keep=()):
+        for video_path in [path for path in self.prepared if path not in keep]:
+            prepared = self.prepared.pop(video_path)
+            # Tearing down a decoder can take a moment, keep it off the game thread
+            threading.Thread(target=prepared.close, daemon=True).start()
+
+    @property
+    def bytes(self):
+        # Pre-decoded frames held for the MemoryBudget's accounting
+        return sum(prepared.bytes for prepared in self.prepared.values())
+
+    def entries(self):
+        return [(video_path, video_path, prepared.bytes, prepared.prepared_at)
+                for video_path, prepared in self.prepared.items()]
+
+    def evict(self, video_path):
+        if video_path in self.prepared:
+            self.cancel(keep=[path for path in self.prepared if path != video_path])
+            self.evictions += 1
+
+
+class VideoPlayer:
+    """Non-blocking clip playback, advanced one frame per Game.run tick via update()."""
+
+    STOPPED = 'stopped'
+    PLAYING = 'playing'
+    FINISHED = 'finished'
+    REPLAYING = 'replaying'
+    GOING_BACK = 'going_back'
+
+    def __init__(self, buffer_depth=FRAME_BUFFER_DEPTH, buffer_max_bytes=FRAME_BUFFER_MAX_BYTES, prefetcher=None,
+                 instrumentation=None, frame_cache=None, backend=None, audio=None):
+        self.buffer_depth = buffer_depth
+        self.buffer_max_bytes = buffer_max_bytes
+        self.prefetcher = prefetcher
+        self.frame_cache = frame_cache
+        self.backend = backend or create_backend()
+        # AudioPlayer, or None to play video only
+        self.audio = audio
+        self.audio_playing = False
+        # Set by the QualityController
+        self.quality = FULL_QUALITY
+        # (video_path, clip, frame_buffer, decoder) pre-rolled by queue(), and whether update() switched to it
+        self.queued = None
+        self.handed_over = False
+        self.instrumentation = instrumentation or Instrumentation()
+        self.state = self.STOPPED
+        self.video_path = None
+        self.clip = None
+        self.decoder = None
+        self.frame_buffer = None
+        self.frame_surface = None
+        self.frame_time = None
+        self.clock = PresentationClock()
+        self.started_at = None
+        # Session totals, and where they stood when the current clip started
+        self.underruns = 0
+        self.dropped_frames = 0
+        self.max_drift = 0.0
+        self.clip_started_counts = (0, 0)
+        self.clip_max_drift = 0.0
+        self.frames_uploaded = 0
+        self.surface_allocations = 0
+        self.allocated_bytes = 0
+
+    def play(self, video_path, size, start=0.0):
+        """Plays the clip from `start` seconds in, e.g. to resume a saved session."""
+        self.close()
+        self.frame_surface = None
+        self.start_clip(video_path, *self.open_source(video_path, size, start))
+
+    def open_source(self, video_path, size, start=0.0):
+        # Cheapest source first: frames already in memory, then a prefetched clip, then a cold open. Both of the
+        # former start at the beginning, so a clip resumed mid-way is always opened cold
+        source = self.ready_source(video_path, size) if not start else None
+        if source is not None:
+            return source
+        clip = open_clip(video_path, size, self.backend, self.quality, start)
+        record_limit = self.frame_cache.max_bytes if self.frame_cache is not None else 0
+        return self.start_decoder(clip, size, record_limit, start)
+
+    def ready_source(self, video_path, size, wait=True):
+        # (clip, frame_buffer, decoder) from the frame cache or the prefetcher, or None. Without wait, a prefetched
+        # clip that is still opening counts as not there
+        if self.frame_cache is not None and (wait or self.frame_cache.contains(video_path, size)):
+            cached = self.frame_cache.get(video_path, size)
+            if cached is not None:
+                return self.start_decoder(CachedClip(cached), size)
+        prepared = self.prefetcher.take(video_path, size, wait) if self.prefetcher is not None else None
+        if prepared is None:
+            return None
+        prepared.frame_buffer.set_max_frames(self.buffer_depth)
+        prepared.decoder.quality = self.quality
+        return prepared.clip, prepared.frame_buffer, prepared.decoder
+
+    def start_decoder(self, clip, size, record_limit=0, start=0.0):
+        frame_buffer = FrameBuffer(self.buffer_depth, self.buffer_max_bytes)
+        decoder = FrameDecoder(clip, size, frame_buffer, self.instrumentation, record_limit, self.backend,
+                               self.quality, start)
+        decoder.start()
+        return clip, frame_buffer, decoder
+
+    def start_clip(self, video_path, clip, frame_buffer, decoder):
+        self.video_path = video_path
+        self.clip, self.frame_buffer, self.decoder = clip, frame_buffer, decoder
+        self.frame_time = None
+        self.clock = PresentationClock(decoder.offset)
+        self.started_at = time.perf_counter()
+        self.clip_started_counts = (self.dropped_frames, self.underruns)
+        self.clip_max_drift = 0.0
+        if self.audio is not None:
+            # Usually decoded already by preload(); if not, the video waits for it in ready_to_start()
+            self.audio.request(video_path)
+        self.state = self.PLAYING
+
+    def queue(self, video_path, size):
+        """Pre-rolls the clip that follows this one, so update() can switch to it without a gap.
+
+        Called every tick near the end of a clip, so nothing is opened here: only a cached or an already prepared
+        clip is queued. If none is ready by the end, the clip ends normally and the next one is opened as usual.
+        Returns whether a clip is queued.
+        """
+        if self.queued is None:
+            source = self.ready_source(video_path, size, wait=False)
+            if source is not None:
+                self.queued = (video_path, *source)
+        return self.queued is not None
+
+    def hand_over(self):
+        # The current clip just ended: start the queued one in the same tick, keeping the last frame on screen
+        # until the new clip's first frame replaces it
+        queued, self.queued = self.queued, None
+        self.close()
+        self.start_clip(*queued)
+        self.handed_over = True
+
+    @property
+    def remaining(self):
+        # Seconds left in the current clip, or None before it started
+        if self.state != self.PLAYING or not self.clock.running:
+            return None
+        return self.clip.duration - self.clock.time()
+
+    @property
+    def position(self):
+        # Seconds into the current clip's file, or None when no clip is playing
+        if self.state != self.PLAYING:
+            return None
+        return self.clock.offset + (self.clock.time() if self.clock.running else 0.0)
+
+    def replay(self, video_path):
+        # Takes the clip explicitly: after Back over a stored still the player may still hold the node that was left
+        self.video_path = video_path
+        self.state = self.REPLAYING
+
+    def go_back(self, video_path):
+        self.video_path = video_path
+        self.state = self.GOING_BACK
+
+    def skip(self):
+        if self.state == self.PLAYING:
+            self.close()
+            self.state = self.FINISHED
+
+    def resize(self, size):
+        if self.decoder is not None:
+            self.decoder.size = size
+        if self.queued is not None:
+            self.queued[3].size = size
+
+    def set_quality(self, quality):
+        # Applies to the running clip from its next frame on, and to every clip opened after it
+        self.quality = quality
+        if self.decoder is not None:
+            self.decoder.quality = quality
+        if self.queued is not None:
+            self.queued[3].quality = quality
+        if self.prefetcher is not None:
+            self.prefetcher.set_quality(quality)
+
+    def update(self, size):
+        # Replay and back are only requested from the event loop; the restart happens here on the next tick
+        if self.state in (self.REPLAYING, self.GOING_BACK):
+            self.play(self.video_path, size)
+
+        if self.state != self.PLAYING:
+            return self.frame_surface
+
+        if not self.clock.running:
+            if not self.ready_to_start():
+                return self.frame_surface
+            self.audio_playing = self.audio is not None and self.audio.play(self.video_path, self.clock.offset)
+            self.clock.start(self.audio if self.audio_playing else None)
+
+        now = self.clock.time()
+        due, dropped = self.frame_buffer.pop_due(now)
+        for frame_surface in dropped:
+            # Late frames are skipped rather than slowing playback down
+            self.decoder.surface_pool.release(frame_surface)
+        self.dropped_frames += len(dropped)
+        if due is not None:
+            if self.frame_surface is not None:
+                self.decoder.surface_pool.release(self.frame_surface)
+            self.frame_time, self.frame_surface = due
+            self.clip_max_drift = max(self.clip_max_drift, now - self.frame_time)
+            self.max_drift = max(self.max_drift, self.clip_max_drift)
+
+        if self.frame_buffer.exhausted:
+            error = self.decoder.error
+            if error is not None:
+                self.stop()
+                raise error
+            # Hold the last frame until the audio tail is done
+            if self.audio_playing and self.audio.busy:
+                return self.frame_surface
+            self.cache_decoded_frames()
+            if self.queued is not None:
+                self.hand_over()
+                return self.update(size)
+            self.close()
+            self.state = self.FINISHED
+
+        return self.frame_surface
+
+    @property
+    def clip_stats(self):
+        # (dropped frames, underruns, max drift) of the current or just finished clip alone
+        dropped_frames, underruns = self.clip_started_counts
+        return self.dropped_frames - dropped_frames, self.underruns - underruns, self.clip_max_drift
+
+    def cache_decoded_frames(self):
+        decoder = self.decoder
+        if self.frame_cache is None or not decoder.completed or not decoder.recording:
+            return
+        self.frame_cache.store(self.video_path, decoder.size, decoder.recording)
+
+    def ready_to_start(self):
+        if self.frame_buffer.exhausted:
+            return True
+        if not len(self.frame_buffer):
+            return False
+        # Start only once the audio can start with the first frame, or without it if it takes too long
+        if self.audio is None or self.audio.is_ready(self.video_path):
+            return True
+        if time.perf_counter() - self.started_at > AUDIO_WAIT_SECONDS:
+            print(f"Audio of {self.video_path} not ready after {AUDIO_WAIT_SECONDS:.0f}s, playing without it")
+            return True
+        return False
+
+    def close(self):
+        if self.decoder is not None:
+            self.decoder.stop()
+            self.decoder.join()
+            self.underruns += self.frame_buffer.underruns
+            self.frames_uploaded += self.decoder.surface_pool.frames
+            self.surface_allocations += self.decoder.surface_pool.allocations
+            self.allocated_bytes += self.decoder.surface_pool.allocated_bytes
+            self.decoder = None
+            self.frame_buffer = None
+        if self.audio_playing:
+            self.audio.stop()
+            self.audio_playing = False
+        if self.clip is not None:
+            self.clip.close()
+            self.clip = None
+
+    def stop(self):
+        self.close()
+        if self.queued is not None:
+            _, clip, _, decoder = self.queued
+            self.queued = None
+            decoder.stop()
+            decoder.join()
+            clip.close()
+        self.state = self.STOPPED
+
+    @property
+    def bytes_per_frame(self):
+        return self.allocated_bytes / self.frames_uploaded if self.frames_uploaded else 0
+
+    @property
+    def bytes(self):
+        # Decoded frames waiting to be shown or recorded for the frame cache, for the MemoryBudget; they are what's
+        # playing, so never evicted
+        sources = [(self.frame_buffer, self.decoder)]
+        if self.queued is not None:
+            sources.append(self.queued[2:])
+        return sum(frame_buffer.bytes + decoder.recorded_bytes for frame_buffer, decoder in sources
+                   if frame_buffer is not None)
+
+    def entries(self):
+        return []
+
+    @property
+    def drift(self):
+        # How far behind the presentation clock the frame on screen is
+        if self.frame_time is None or not self.clock.running:
+            return 0.0
+        return self.clock.time() - self.frame_time
@@ -0,0 +1,59 @@
+"""Preflight: checks that every media file a story references exists and indexes its metadata and end frames.
+
+Probing runs in parallel, one process per file, and only for files that changed since the last run. Exits
+non-zero if anything is missing or could not be probed, so it can gate an installation:
+
+    python preflight.py --nodes nodes.json
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from decoders import BACKENDS
+from media_index import MEDIA_INDEX_DIR, MediaIndex, index_media
+from story import story_media
+from story_store import load_story
+
+DEFAULT_NODES = 'nodes.json'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', default=DEFAULT_NODES, help='story graph to check')
+    parser.add_argument('--output', default=MEDIA_INDEX_DIR, help='directory of the media index')
+    parser.add_argument('--decoder', choices=sorted(BACKENDS), help='decoder backend used for probing')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='parallel probe processes')
+    parser.add_argument('--force', action='store_true', help='re-probe files that are already indexed')
+    args = parser.parse_args()
+
+    media = story_media(load_story(args.nodes))
+    media_index = MediaIndex(args.output)
+    missing, unindexed = media_index.validate(media)
+    for path in missing:
+        print(f"Missing: {path}")
+    if args.force:
+        unindexed = [path for path in media if path not in missing]
+
+    os.makedirs(args.output, exist_ok=True)
+    failed = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(index_media, path, media[path], args.output, args.decoder): path
+                   for path in unindexed}
+        for future in as_completed(futures):
+            try:
+                media_index.store(future.result())
+            except Exception as e:
+                failed += 1
+                print(f"Error probing {futures[future]}: {e}")
+    media_index.save()
+
+    print(f"{len(media)} media files, {len(missing)} missing, {len(unindexed) - failed} probed, {failed} failed "
+          f"in {time.perf_counter() - started:.1f}s")
+    return 1 if missing or failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import json
+import time
+
+from instrumentation import Instrumentation
+
+# Budget of one render loop tick; Game.tick runs at 60 fps while a clip plays
+FRAME_BUDGET_SECONDS = 1 / 60
+# Load and dropped frames are judged over windows of this length
+QUALITY_WINDOW_SECONDS = 1.0
+# Step down as soon as a window is busier than this, or dropped more frames than that
+STEP_DOWN_LOAD = 0.9
+STEP_DOWN_DROPPED_FRAMES = 3
+# Step back up only after this many calm windows in a row below STEP_UP_LOAD; the wait doubles each time a step up
+# has to be taken back, up to MAX_STEP_UP_WINDOWS
+STEP_UP_LOAD = 0.6
+STEP_UP_WINDOWS = 3
+MAX_STEP_UP_WINDOWS = 48
+
+
+class QualityLevel:
+    """One rung of the quality ladder: how a clip is decoded and brought to the window size.
+
+    interpolation and skip_frame go to PyAV (swscale's scaler and FFmpeg's frame skipping); cached and baked clips,
+    which have nothing to decode, present only every frame_step-th frame instead.
+    """
+
+    def __init__(self, name, resolution=1.0, interpolation=None, skip_frame=None, frame_step=1):
+        self.name = name
+        self.resolution = resolution
+        self.interpolation = interpolation
+        self.skip_frame = skip_frame
+        self.frame_step = frame_step
+
+    def decode_size(self, size):
+        if self.resolution == 1.0:
+            return size
+        # Even dimensions keep swscale on its fast paths
+        return tuple(max(2, int(side * self.resolution) // 2 * 2) for side in size)
+
+    def __repr__(self):
+        return f'QualityLevel({self.name!r})'
+
+
+# Best first. Measured on a 1080p60 clip shown in a 1280x720 window on one core, per source frame: full 17 ms,
+# fast_scaling 11 ms, half_resolution 8 ms, reference_frames 3 ms, keyframes 0.3 ms
+QUALITY_LADDER = [
+    QualityLevel('full'),
+    QualityLevel('fast_scaling', interpolation='FAST_BILINEAR'),
+    # Upscaled to the window with pygame's nearest neighbour scale, which is cheap next to the halved conversion
+    QualityLevel('half_resolution', resolution=0.5, interpolation='FAST_BILINEAR'),
+    # Drops the frames nothing else refers to (B-frames), roughly halving the decoded frame rate
+    QualityLevel('reference_frames', resolution=0.5, interpolation='FAST_BILINEAR', skip_frame='NONREF',
+                 frame_step=2),
+    QualityLevel('keyframes', resolution=0.5, interpolation='POINT', skip_frame='NONKEY', frame_step=4),
+]
+FULL_QUALITY = QUALITY_LADDER[0]
+QUALITY_LEVELS = {level.name: level for level in QUALITY_LADDER}
+
+
+class QualityController:
+    """Moves the player down the quality ladder while playback runs short of frame-time headroom, and back up with
+    hysteresis once the headroom has returned.
+
+    Load is the busier of the render loop (tick work per wall second) and the decoder (decoding seconds per second
+    of video). Every change is printed, sent to the instrumentation as the 'quality' gauge, kept in `changes` and,
+    with a log_path, appended to that .jsonl file.
+    """
+
+    def __init__(self, player, instrumentation=None, level=None, adaptive=True, log_path=None,
+                 budget=FRAME_BUDGET_SECONDS):
+        self.player = player
+        self.instrumentation = instrumentation or Instrumentation()
+        self.adaptive = adaptive
+        self.log_path = log_path
+        self.budget = budget
+        self.level = QUALITY_LADDER.index(level) if level is not None else 0
+        self.changes = []
+        self.calm_windows = 0
+        self.step_up_windows = STEP_UP_WINDOWS
+        self.stepped_up_at = None
+        self.windows = 0
+        self.window = None
+        player.set_quality(self.quality)
+
+    @property
+    def quality(self):
+        return QUALITY_LADDER[self.level]
+
+    def update(self, work_seconds):
+        """Called every tick a clip is playing, with the time the tick spent working (not waiting for vsync)."""
+        if not self.adaptive:
+            return
+        player = self.player
+        decoder = player.decoder
+        if decoder is None or not player.clock.running:
+            self.window = None
+            return
+        now = time.perf_counter()
+        window = self.window
+        if window is None or window['decoder'] is not decoder:
+            # A new clip starts a new window; its pre-rolled frames say nothing about the current load
+            self.window = {'decoder': decoder, 'started': now, 'work': 0.0, 'busy': decoder.busy_seconds,
+                           'position': player.clock.time(), 'dropped': player.dropped_frames}
+            return
+        window['work'] += work_seconds
+        elapsed = now - window['started']
+        if elapsed < QUALITY_WINDOW_SECONDS:
+            return
+
+        video_seconds = player.clock.time() - window['position']
+        render_load = window['work'] / elapsed
+        decode_load = (decoder.busy_seconds - window['busy']) / video_seconds if video_seconds > 0 else 0.0
+        dropped = player.dropped_frames - window['dropped']
+        self.window = None
+        self.windows += 1
+        self.judge(render_load, decode_load, dropped)
+
+    def judge(self, render_load, decode_load, dropped):
+        load = max(render_load, decode_load)
+        measurements = {'load': load, 'render_load': render_load, 'decode_load': decode_load, 'dropped': dropped}
+        if load > STEP_DOWN_LOAD or dropped > STEP_DOWN_DROPPED_FRAMES:
+            self.calm_windows = 0
+            if self.stepped_up_at is not None and self.windows - self.stepped_up_at <= self.step_up_windows:
+                # The last step up did not hold: wait longer before trying again
+                self.step_up_windows = min(MAX_STEP_UP_WINDOWS, self.step_up_windows * 2)
+            self.stepped_up_at = None
+            if self.level < len(QUALITY_LADDER) - 1:
+                self.change(self.level + 1, 'short of headroom', measurements)
+        elif load < STEP_UP_LOAD and not dropped:
+            self.calm_windows += 1
+            if self.level > 0 and self.calm_windows >= self.step_up_windows:
+                self.calm_windows = 0
+                self.stepped_up_at = self.windows
+                self.change(self.level - 1, 'headroom regained', measurements)
+        else:
+            self.calm_windows = 0
+
+    def change(self, level, reason, measurements):
+        previous = self.quality
+        self.level = level
+        self.player.set_quality(self.quality)
+        entry = {'time': time.time(), 'from': previous.name, 'to': self.quality.name, 'reason': reason,
+                 'clip': self.player.video_path, 'window': list(self.player.decoder.size),
+                 **{key: round(value, 3) for key, value in measurements.items()}}
+        self.changes.append(entry)
+        print(f"Quality {previous.name} -> {self.quality.name} ({reason}: load {entry['load']:.0%}, "
+              f"render {entry['render_load']:.0%}, decode {entry['decode_load']:.0%}, {entry['dropped']} dropped) "
+              f"in {entry['clip']}")
+        self.instrumentation.gauge('quality', self.quality.name)
+        if self.log_path:
+            with open(self.log_path, 'a') as file:
+                file.write(json.dumps(entry) + '\n')
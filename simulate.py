@@ -0,0 +1,198 @@
+"""Headless story simulator: explores every reachable (node, state) configuration and reports problems in the graph.
+
+Uses the game's own story model (story.py) without pygame or any media, skips configurations it has already
+seen, expands all configurations at the same node as one NumPy batch and spreads each breadth-first level over a
+process pool:
+
+    python simulate.py --nodes nodes.json --max-depth 100 --max-states 5000000 --output report.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from story import SessionStates, build_trigger_index, state_names
+from story_store import load_story
+
+DEFAULT_NODES = 'nodes.json'
+START_NODE = 'intro_node'
+# Configurations handed to a worker process at a time
+BATCH_SIZE = 5000
+
+# Loaded once per process by load_graph()
+nodes = None
+trigger_index = None
+names = None
+
+
+def load_graph(node_file):
+    global nodes, trigger_index, names
+    nodes = load_story(node_file)
+    trigger_index = build_trigger_index(nodes)
+    names = state_names(nodes)
+
+
+def expand(configs):
+    """Per configuration: (automatic, [(choice_text, target_key, entered_key, next_states)]).
+
+    A configuration is (node_key, the states as a tuple in `names` column order). entered_key differs from
+    target_key when a trigger fired, and is None when the target does not exist.
+    """
+    by_node = {}
+    for position, (node_key, states) in enumerate(configs):
+        by_node.setdefault(node_key, []).append(position)
+    results = [None] * len(configs)
+    for node_key, positions in by_node.items():
+        node = nodes[node_key]
+        sessions = SessionStates.from_rows([configs[position][1] for position in positions], names)
+        steps = [[] for _ in positions]
+        # Mirrors the game: a video node with a single choice plays on into it whatever its condition says,
+        # any other node offers the choices whose condition holds
+        automatic = node.is_video and len(node.choices) == 1
+        masks = None if automatic else sessions.choice_masks(node)
+        for choice_text, target_key in node.choices.items():
+            offered = np.arange(len(sessions)) if automatic else np.flatnonzero(masks[choice_text])
+            if not len(offered):
+                continue
+            if target_key not in nodes:
+                for row in offered:
+                    steps[row].append((choice_text, target_key, None, None))
+                continue
+            branch = sessions.select(offered)
+            entered = branch.enter(nodes, trigger_index, target_key)
+            for row, entered_key, next_states in zip(offered, entered, map(tuple, branch.values.tolist())):
+                steps[row].append((choice_text, target_key, entered_key, next_states))
+        for position, config_steps in zip(positions, steps):
+            results[position] = (automatic, config_steps)
+    return results
+
+
+def find_loops(automatic_next):
+    # automatic_next maps a configuration to the one it moves on to without input, so each configuration has at
+    # most one successor and every cycle is found by walking forward until we revisit the current walk
+    loops = {}
+    done = set()
+    for start in automatic_next:
+        walk = {}
+        config = start
+        while config in automatic_next and config not in done and config not in walk:
+            walk[config] = len(walk)
+            config = automatic_next[config][0]
+        if config in walk:
+            cycle = list(walk)[walk[config]:]
+            node_keys = [node_key for node_key, _ in cycle]
+            # The same loop shows up under many states and starting points; keep one rotation of it
+            first = node_keys.index(min(node_keys))
+            node_keys = tuple(node_keys[first:] + node_keys[:first])
+            triggered = any(automatic_next[config][1] for config in cycle)
+            loops[node_keys] = loops.get(node_keys, False) or triggered
+        done.update(walk)
+    return loops
+
+
+def simulate(node_file, start=START_NODE, max_depth=100, max_states=1000000, workers=1):
+    load_graph(node_file)
+    start_config = (start, (0,) * len(names))
+    seen = {start_config}
+    frontier = [start_config]
+    reached = {start}
+    choices_taken = set()
+    dead_ends = Counter()
+    broken_links = set()
+    trigger_firings = Counter()
+    automatic_next = {}
+    steps = 0
+    depth = 0
+    truncated = False
+    started = time.perf_counter()
+
+    pool = ProcessPoolExecutor(workers, initializer=load_graph, initargs=(node_file,)) if workers > 1 else None
+    try:
+        while frontier and depth < max_depth:
+            batches = [frontier[index:index + BATCH_SIZE] for index in range(0, len(frontier), BATCH_SIZE)]
+            # Narrow levels are cheaper to expand here than to ship to a worker and back
+            results = pool.map(expand, batches) if pool is not None and len(batches) > 1 else map(expand, batches)
+            frontier = []
+            for batch, batch_results in zip(batches, results):
+                for config, (automatic, config_steps) in zip(batch, batch_results):
+                    node_key = config[0]
+                    if not config_steps:
+                        dead_ends[node_key] += 1
+                    for choice_text, target_key, entered_key, next_states in config_steps:
+                        steps += 1
+                        choices_taken.add((node_key, choice_text))
+                        if entered_key is None:
+                            broken_links.add((node_key, choice_text, target_key))
+                            continue
+                        if entered_key != target_key:
+                            trigger_firings[(target_key, entered_key)] += 1
+                        reached.add(entered_key)
+                        next_config = (entered_key, next_states)
+                        if automatic:
+                            automatic_next[config] = (next_config, entered_key != target_key)
+                        if next_config in seen:
+                            continue
+                        if len(seen) >= max_states:
+                            truncated = True
+                            continue
+                        seen.add(next_config)
+                        frontier.append(next_config)
+            depth += 1
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    elapsed = time.perf_counter() - started
+    loops = find_loops(automatic_next)
+    total_choices = sum(len(node.choices) for node in nodes.values())
+    return {
+        'nodes': node_file,
+        'start': start,
+        'depth': depth,
+        'configurations': len(seen),
+        'steps': steps,
+        'seconds': elapsed,
+        'steps_per_second': steps / elapsed if elapsed else 0,
+        # Unreachable and coverage are only final if the search ran out of configurations, not budget
+        'complete': not frontier and not truncated,
+        'node_coverage': len(reached) / len(nodes),
+        'choice_coverage': len(choices_taken) / total_choices if total_choices else 1.0,
+        'unreachable_nodes': sorted(set(nodes) - reached),
+        'endings': sorted(node_key for node_key in dead_ends if not nodes[node_key].choices),
+        'dead_ends': {node_key: count for node_key, count in sorted(dead_ends.items()) if nodes[node_key].choices},
+        'broken_links': [{'node': node_key, 'choice': choice_text, 'target': target_key}
+                         for node_key, choice_text, target_key in sorted(broken_links)],
+        'trigger_firings': [{'entering': target_key, 'jumped_to': entered_key, 'count': count}
+                            for (target_key, entered_key), count in trigger_firings.most_common()],
+        'trigger_loops': [list(loop) for loop, triggered in sorted(loops.items()) if triggered],
+        'autoplay_loops': [list(loop) for loop, triggered in sorted(loops.items()) if not triggered],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', default=DEFAULT_NODES, help='story graph to explore')
+    parser.add_argument('--start', default=START_NODE, help='node the game starts in')
+    parser.add_argument('--max-depth', type=int, default=100, help='number of choices to look ahead')
+    parser.add_argument('--max-states', type=int, default=1000000, help='distinct (node, state) configurations')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='parallel expansion processes')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    report = simulate(args.nodes, args.start, args.max_depth, args.max_states, args.workers)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 1 if report['broken_links'] or report['dead_ends'] or report['trigger_loops'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
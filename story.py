@@ -0,0 +1,278 @@
+"""The story model shared by the game and the headless tools: state, nodes, conditions and triggers.
+
+Deliberately free of pygame and media imports so simulate.py can run it across many processes, and analytics
+can run it over thousands of sessions at once (see SessionStates).
+"""
+import json
+import operator
+from collections.abc import Mapping
+
+import numpy as np
+
+CONDITION_OPERATORS = {'==': operator.eq, '>': operator.gt, '<': operator.lt}
+
+
+# Every story has these states, each starting at 0; further names used by a story get columns after them
+STATE_NAMES = ('energy', 'mood', 'alcohol', 'time')
+
+
+class SessionStates:
+    """The states of many sessions at once, as an (N, states) int64 array with a fixed column per state name.
+
+    State actions are applied, and conditions and triggers evaluated, for a whole selection of sessions with NumPy.
+    `sessions` arguments take anything that indexes rows: a boolean mask, an index array or a slice.
+    """
+
+    def __init__(self, count, names=STATE_NAMES):
+        self.names = tuple(names)
+        self.columns = {name: column for column, name in enumerate(self.names)}
+        self.values = np.zeros((count, len(self.names)), dtype=np.int64)
+
+    @classmethod
+    def from_rows(cls, rows, names=STATE_NAMES):
+        session_states = cls(0, names)
+        session_states.values = np.array(rows, dtype=np.int64).reshape(-1, len(session_states.names))
+        return session_states
+
+    def __len__(self):
+        return len(self.values)
+
+    def row(self, index):
+        return GameState(session_states=self, index=index)
+
+    def select(self, sessions):
+        # A copy of some of the sessions, to branch them off
+        selected = SessionStates(0, self.names)
+        selected.values = self.values[sessions].copy()
+        return selected
+
+    def apply_actions(self, state_actions, sessions=slice(None)):
+        """Applies a node's state_actions to the selected sessions and returns the names of the states it changed."""
+        changed_states = []
+        for state_name, value in state_actions.get('set', {}).items():
+            self.values[sessions, self.columns[state_name]] = value
+            changed_states.append(state_name)
+        for state_name, value in state_actions.get('increase', {}).items():
+            self.values[sessions, self.columns[state_name]] += value
+            changed_states.append(state_name)
+        for state_name, value in state_actions.get('decrease', {}).items():
+            self.values[sessions, self.columns[state_name]] -= value
+            changed_states.append(state_name)
+        return changed_states
+
+    def condition_mask(self, condition_params, sessions=slice(None)):
+        state_name, operator_name, value = condition_params
+        return CONDITION_OPERATORS[operator_name](self.values[sessions, self.columns[state_name]], value)
+
+    def choice_masks(self, node, sessions=slice(None)):
+        """Per choice of the node, a boolean mask of the selected sessions that are offered it."""
+        count = len(self.values[sessions])
+        return {
+            choice_text: self.condition_mask(node.conditions[choice_text], sessions)
+            if choice_text in node.choice_conditions else np.ones(count, dtype=bool)
+            for choice_text in node.choices
+        }
+
+    def trigger_targets(self, trigger_index, changed_states, sessions=slice(None)):
+        """Per selected session, the key of the node a trigger sends it to, or None (as an object array)."""
+        targets = np.full(len(self.values[sessions]), None, dtype=object)
+        # Same order as enter_node: a later changed state's trigger overrides an earlier one
+        for state_name in changed_states:
+            column = self.values[sessions, self.columns[state_name]]
+            for (trigger_state, value), node_key in trigger_index.items():
+                if trigger_state == state_name:
+                    targets[column == value] = node_key
+        return targets
+
+    def enter(self, nodes, trigger_index, node_key, sessions=slice(None)):
+        """enter_node for the selected sessions: returns the key each of them actually ends up in."""
+        changed_states = self.apply_actions(nodes[node_key].state_actions, sessions)
+        entered = self.trigger_targets(trigger_index, changed_states, sessions)
+        entered[entered == None] = node_key  # noqa: E711, elementwise comparison
+        return entered
+
+
+class StateRow(Mapping):
+    """Read-only name -> value view of one session's row, what conditions see as GameState.states."""
+
+    __slots__ = ('session_states', 'index')
+
+    def __init__(self, session_states, index):
+        self.session_states = session_states
+        self.index = index
+
+    def __getitem__(self, state_name):
+        return int(self.session_states.values[self.index, self.session_states.columns[state_name]])
+
+    def __iter__(self):
+        return iter(self.session_states.names)
+
+    def __len__(self):
+        return len(self.session_states.names)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class GameState:
+    """One session's states: a thin view onto a row of a SessionStates (its own single row if none is given)."""
+
+    __slots__ = ('session_states', 'index')
+
+    def __init__(self, names=STATE_NAMES, session_states=None, index=0):
+        self.session_states = session_states if session_states is not None else SessionStates(1, names)
+        self.index = index
+
+    @property
+    def states(self):
+        return StateRow(self.session_states, self.index)
+
+    @states.setter
+    def states(self, states):
+        for state_name, value in states.items():
+            self.set_state(state_name, value)
+
+    def set_state(self, state_name, value):
+        self.session_states.values[self.index, self.session_states.columns[state_name]] = value
+
+    def get_state(self, state_name):
+        column = self.session_states.columns.get(state_name)
+        return None if column is None else int(self.session_states.values[self.index, column])
+
+    def increase_state(self, state_name, amount):
+        if state_name in self.session_states.columns:
+            self.session_states.values[self.index, self.session_states.columns[state_name]] += amount
+
+    def decrease_state(self, state_name, amount):
+        if state_name in self.session_states.columns:
+            self.session_states.values[self.index, self.session_states.columns[state_name]] -= amount
+
+    def check_state(self, state_name, condition):
+        return condition(self.get_state(state_name))
+
+
+def state_names(nodes):
+    # STATE_NAMES plus any other state the story's actions, conditions or triggers mention, in order of appearance.
+    # A compiled story (story_store.py) has this and the other startup indexes below precomputed
+    if hasattr(nodes, 'state_names'):
+        return nodes.state_names()
+    names = list(STATE_NAMES)
+    for node in nodes.values():
+        mentioned = [name for action in node.state_actions.values() for name in action]
+        mentioned += list(node.instant_trigger)
+        mentioned += [node.conditions[choice_text][0] for choice_text in node.choice_conditions]
+        names += [name for name in mentioned if name not in names]
+    return tuple(dict.fromkeys(names))
+
+
+def compile_condition(condition_params):
+    # Turns ["energy", ">", 5] into a predicate over GameState.states, built once at load time
+    state_name, operator_name, value = condition_params
+    if operator_name not in CONDITION_OPERATORS:
+        raise ValueError(f'Invalid operator: {operator_name}')
+    compare = CONDITION_OPERATORS[operator_name]
+    return lambda states: compare(states.get(state_name), value)
+
+
+class Node:
+    __slots__ = ('key', 'media_path', 'choices', 'conditions', 'is_video', 'state_actions', 'instant_trigger',
+                 'choice_conditions')
+
+    def __init__(self, media_path, choices, conditions=None, is_video=True, state_actions=None, instant_trigger=None,
+                 key=None):
+        self.key = key
+        self.media_path = media_path
+        self.choices = choices
+        self.conditions = conditions if conditions else {}
+        self.is_video = is_video
+        self.state_actions = state_actions if state_actions else {'set': {}, 'increase': {}, 'decrease': {}}
+        self.instant_trigger = instant_trigger if instant_trigger else {}  # New attribute
+        # Conditions that aren't [state, operator, value] triples never hide their choice
+        self.choice_conditions = {
+            choice_text: compile_condition(condition_params)
+            for choice_text, condition_params in self.conditions.items()
+            if len(condition_params) == 3
+        }
+
+
+def build_trigger_index(nodes):
+    # (state_name, value) -> key of the node that state value instantly jumps to; the first node in the file wins
+    if hasattr(nodes, 'trigger_index'):
+        return nodes.trigger_index()
+    trigger_index = {}
+    for node_key, node in nodes.items():
+        for state_name, value in node.instant_trigger.items():
+            trigger_index.setdefault((state_name, value), node_key)
+    return trigger_index
+
+
+def find_gapless_successors(nodes):
+    # Video node key -> the video node its only choice leads to; such chains are one film split into files
+    if hasattr(nodes, 'gapless_successors'):
+        return nodes.gapless_successors()
+    successors = {}
+    for node_key, node in nodes.items():
+        if not node.is_video or len(node.choices) != 1:
+            continue
+        next_node = nodes.get(next(iter(node.choices.values())))
+        if next_node is not None and next_node.is_video and next_node.media_path:
+            successors[node_key] = next_node.key
+    return successors
+
+
+def story_media(nodes):
+    # media_path -> is_video of every node that shows something
+    if hasattr(nodes, 'media'):
+        return nodes.media()
+    return {node.media_path: node.is_video for node in nodes.values() if node.media_path}
+
+
+def load_nodes(node_file):
+    # Parses the authoring JSON into Nodes all at once; the game and tools load through story_store.load_story
+    with open(node_file, 'r') as file:
+        data = json.load(file)
+
+    nodes = {}
+    for key, value in data.items():
+        nodes[key] = Node(key=key, **value)
+
+    return nodes
+
+
+def is_choice_available(node, choice_text, states):
+    condition = node.choice_conditions.get(choice_text)
+    return condition is None or condition(states)
+
+
+def enter_node(game_state, nodes, trigger_index, node_key):
+    """Applies the node's state actions and returns the key of the node actually entered.
+
+    That is the node itself unless a state it just changed instantly triggers another node.
+    """
+    node = nodes[node_key]
+    changed_states = []
+
+    # Check and apply 'set' actions
+    if 'set' in node.state_actions:
+        for state_name, value in node.state_actions['set'].items():
+            game_state.set_state(state_name, value)
+            changed_states.append(state_name)
+
+    # Check and apply 'increase' actions
+    if 'increase' in node.state_actions:
+        for state_name, value in node.state_actions['increase'].items():
+            game_state.increase_state(state_name, value)
+            changed_states.append(state_name)
+
+    # Check and apply 'decrease' actions
+    if 'decrease' in node.state_actions:
+        for state_name, value in node.state_actions['decrease'].items():
+            game_state.decrease_state(state_name, value)
+            changed_states.append(state_name)
+
+    # Check if any node is triggered by the states this node just changed
+    for state_name in changed_states:
+        triggered_node_key = trigger_index.get((state_name, game_state.get_state(state_name)))
+        if triggered_node_key is not None:
+            node_key = triggered_node_key
+    return node_key
@@ -0,0 +1,298 @@
+"""Compiled stories: nodes.json turned into a compact binary graph that is memory-mapped and read node by node.
+
+Every string (node keys, media paths, choice texts, state names, operators and JSON-encoded values) is stored once
+in a string table and referred to by number. Nodes, choices, conditions, state actions and triggers are arrays of
+fixed-size records, each node pointing at its slice of the others. The indexes the game builds at startup (trigger
+index, gapless successors, state names, media list) are computed once at compile time and stored alongside, so
+loading a story of any size touches only the nodes that are actually visited.
+"""
+import json
+import mmap
+import os
+import struct
+from collections.abc import Mapping
+
+import numpy as np
+
+from story import Node, build_trigger_index, find_gapless_successors, load_nodes, state_names
+from utils import file_signature
+
+COMPILED_SUFFIX = '.storyc'
+MAGIC = b'STORYC'
+FORMAT_VERSION = 1
+# Stands in for a missing string, e.g. a node without media
+NO_STRING = 0xFFFFFFFF
+
+NODE_DTYPE = np.dtype([('key', '<u4'), ('media_path', '<u4'), ('is_video', 'u1'),
+                       ('choices', '<u4'), ('choice_count', '<u4'), ('conditions', '<u4'), ('condition_count', '<u4'),
+                       ('actions', '<u4'), ('action_count', '<u4'), ('triggers', '<u4'), ('trigger_count', '<u4')])
+# Choice text -> target node key; condition choice text -> [state, operator, value] as JSON
+PAIR_DTYPE = np.dtype([('name', '<u4'), ('value', '<u4')])
+# 'set'/'increase'/'decrease', state name, JSON value
+ACTION_DTYPE = np.dtype([('kind', '<u4'), ('state', '<u4'), ('value', '<u4')])
+# Trigger index entries: state name, JSON value, node key
+TRIGGER_DTYPE = np.dtype([('state', '<u4'), ('value', '<u4'), ('node', '<u4')])
+MEDIA_DTYPE = np.dtype([('path', '<u4'), ('is_video', 'u1')])
+
+# Section name -> dtype, in file order
+SECTIONS = [
+    ('string_offsets', np.dtype('<u8')),
+    ('string_data', np.dtype('u1')),
+    ('nodes', NODE_DTYPE),
+    ('key_order', np.dtype('<u4')),
+    ('choices', PAIR_DTYPE),
+    ('conditions', PAIR_DTYPE),
+    ('actions', ACTION_DTYPE),
+    ('triggers', PAIR_DTYPE),
+    ('trigger_index', TRIGGER_DTYPE),
+    ('gapless_successors', PAIR_DTYPE),
+    ('state_names', np.dtype('<u4')),
+    ('media', MEDIA_DTYPE),
+]
+# Magic, version, source mtime in ns, source size, then (offset, count) per section
+HEADER = struct.Struct('<6sHqq' + 'QQ' * len(SECTIONS))
+
+
+def compiled_path(node_file):
+    return os.path.splitext(node_file)[0] + COMPILED_SUFFIX
+
+
+class StringTable:
+    """Interns strings while compiling."""
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, text):
+        if text is None:
+            return NO_STRING
+        string_id = self.ids.get(text)
+        if string_id is None:
+            string_id = self.ids[text] = len(self.strings)
+            self.strings.append(text)
+        return string_id
+
+    def value(self, value):
+        # Values keep their JSON type by being stored as their JSON text
+        return self.intern(json.dumps(value))
+
+    def arrays(self):
+        data = [text.encode('utf-8') for text in self.strings]
+        offsets = np.zeros(len(data) + 1, dtype='<u8')
+        np.cumsum([len(chunk) for chunk in data], out=offsets[1:])
+        return offsets, np.frombuffer(b''.join(data), dtype='u1')
+
+
+def compile_story(node_file, output=None):
+    """Compiles a nodes.json into its binary form and returns the path written. Replaces the file atomically."""
+    output = output or compiled_path(node_file)
+    signature = file_signature(node_file)
+    nodes = load_nodes(node_file)
+    strings = StringTable()
+    records = {name: [] for name in ('choices', 'conditions', 'actions', 'triggers')}
+
+    node_records = []
+    for node in nodes.values():
+        starts = {name: len(rows) for name, rows in records.items()}
+        records['choices'] += [(strings.intern(text), strings.intern(target)) for text, target in node.choices.items()]
+        records['conditions'] += [(strings.intern(text), strings.value(params))
+                                  for text, params in node.conditions.items()]
+        records['actions'] += [(strings.intern(kind), strings.intern(state_name), strings.value(value))
+                               for kind, action in node.state_actions.items()
+                               for state_name, value in action.items()]
+        records['triggers'] += [(strings.intern(state_name), strings.value(value))
+                                for state_name, value in node.instant_trigger.items()]
+        node_records.append((strings.intern(node.key), strings.intern(node.media_path), node.is_video,
+                             starts['choices'], len(node.choices), starts['conditions'], len(node.conditions),
+                             starts['actions'], len(records['actions']) - starts['actions'],
+                             starts['triggers'], len(node.instant_trigger)))
+
+    sections = {
+        'nodes': np.array(node_records, dtype=NODE_DTYPE),
+        'choices': np.array(records['choices'], dtype=PAIR_DTYPE),
+        'conditions': np.array(records['conditions'], dtype=PAIR_DTYPE),
+        'actions': np.array(records['actions'], dtype=ACTION_DTYPE),
+        'triggers': np.array(records['triggers'], dtype=PAIR_DTYPE),
+        'trigger_index': np.array([(strings.intern(state_name), strings.value(value), strings.intern(node_key))
+                                   for (state_name, value), node_key in build_trigger_index(nodes).items()],
+                                  dtype=TRIGGER_DTYPE),
+        'gapless_successors': np.array([(strings.intern(node_key), strings.intern(next_key))
+                                        for node_key, next_key in find_gapless_successors(nodes).items()],
+                                       dtype=PAIR_DTYPE),
+        'state_names': np.array([strings.intern(name) for name in state_names(nodes)], dtype='<u4'),
+        'media': np.array([(strings.intern(node.media_path), node.is_video)
+                           for node in nodes.values() if node.media_path], dtype=MEDIA_DTYPE),
+    }
+    # Node keys sorted by their UTF-8 bytes, for binary search without a dict of every key
+    sections['key_order'] = np.array(sorted(range(len(node_records)),
+                                            key=lambda index: strings.strings[node_records[index][0]].encode('utf-8')),
+                                     dtype='<u4')
+    sections['string_offsets'], sections['string_data'] = strings.arrays()
+
+    table = []
+    offset = HEADER.size
+    for name, dtype in SECTIONS:
+        # Records stay aligned to 8 bytes
+        offset = (offset + 7) // 8 * 8
+        table += [offset, len(sections[name])]
+        offset += sections[name].nbytes
+
+    temporary = f'{output}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, *signature, *table))
+        for (name, dtype), section_offset in zip(SECTIONS, table[::2]):
+            file.write(b'\0' * (section_offset - file.tell()))
+            file.write(sections[name].astype(dtype, copy=False).tobytes())
+    os.replace(temporary, output)
+    return output
+
+
+def read_header(compiled_file):
+    # (version, signature, [(offset, count)]) or None if it isn't a compiled story
+    with open(compiled_file, 'rb') as file:
+        header = file.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    magic, version, mtime_ns, size, *table = HEADER.unpack(header)
+    if magic != MAGIC:
+        return None
+    return version, (mtime_ns, size), list(zip(table[::2], table[1::2]))
+
+
+def is_fresh(node_file, compiled_file):
+    try:
+        header = read_header(compiled_file)
+    except OSError:
+        return False
+    return header is not None and header[0] == FORMAT_VERSION and header[1] == file_signature(node_file)
+
+
+class CompiledNodes(Mapping):
+    """Node key -> Node over a memory-mapped compiled story, building each Node the first time it is looked up.
+
+    Iterates in the order of the source file, like the dict load_nodes() returns. The startup indexes are read
+    straight from the file by the story.py functions that would otherwise visit every node.
+    """
+
+    def __init__(self, compiled_file):
+        header = read_header(compiled_file)
+        if header is None or header[0] != FORMAT_VERSION:
+            raise ValueError(f"{compiled_file} is not a compiled story of format version {FORMAT_VERSION}")
+        with open(compiled_file, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.compiled_file = compiled_file
+        self.sections = {name: np.frombuffer(self.map, dtype=dtype, count=count, offset=offset)
+                         for (name, dtype), (offset, count) in zip(SECTIONS, header[2])}
+        self.string_data_offset = header[2][1][0]
+        self.string_cache = {}
+        self.value_cache = {}
+        self.node_cache = {}
+
+    def string(self, string_id):
+        if string_id == NO_STRING:
+            return None
+        text = self.string_cache.get(string_id)
+        if text is None:
+            offsets = self.sections['string_offsets']
+            start = self.string_data_offset + int(offsets[string_id])
+            end = self.string_data_offset + int(offsets[string_id + 1])
+            text = self.string_cache[string_id] = self.map[start:end].decode('utf-8')
+        return text
+
+    def value(self, string_id):
+        if string_id not in self.value_cache:
+            self.value_cache[string_id] = json.loads(self.string(string_id))
+        return self.value_cache[string_id]
+
+    def find(self, node_key):
+        # Binary search over the key order table; returns the node's index or None
+        target = node_key.encode('utf-8')
+        order = self.sections['key_order']
+        keys = self.sections['nodes']['key']
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.string(int(keys[order[middle]])).encode('utf-8') < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(order) and self.string(int(keys[order[low]])) == node_key:
+            return int(order[low])
+        return None
+
+    def node(self, index):
+        record = self.sections['nodes'][index]
+        key = self.string(int(record['key']))
+        node = self.node_cache.get(key)
+        if node is not None:
+            return node
+
+        def rows(section, start, count):
+            return self.sections[section][int(record[start]):int(record[start]) + int(record[count])].tolist()
+
+        state_actions = {}
+        for kind, state_name, value in rows('actions', 'actions', 'action_count'):
+            state_actions.setdefault(self.string(kind), {})[self.string(state_name)] = self.value(value)
+        node = Node(
+            key=key,
+            media_path=self.string(int(record['media_path'])),
+            choices={self.string(text): self.string(target)
+                     for text, target in rows('choices', 'choices', 'choice_count')},
+            conditions={self.string(text): self.value(params)
+                        for text, params in rows('conditions', 'conditions', 'condition_count')},
+            is_video=bool(record['is_video']),
+            state_actions=state_actions,
+            instant_trigger={self.string(state_name): self.value(value)
+                             for state_name, value in rows('triggers', 'triggers', 'trigger_count')},
+        )
+        self.node_cache[key] = node
+        return node
+
+    def __getitem__(self, node_key):
+        node = self.node_cache.get(node_key)
+        if node is not None:
+            return node
+        index = self.find(node_key) if isinstance(node_key, str) else None
+        if index is None:
+            raise KeyError(node_key)
+        return self.node(index)
+
+    def __iter__(self):
+        for string_id in self.sections['nodes']['key'].tolist():
+            yield self.string(string_id)
+
+    def __len__(self):
+        return len(self.sections['nodes'])
+
+    def trigger_index(self):
+        return {(self.string(state_name), self.value(value)): self.string(node_key)
+                for state_name, value, node_key in self.sections['trigger_index'].tolist()}
+
+    def gapless_successors(self):
+        return {self.string(node_key): self.string(next_key)
+                for node_key, next_key in self.sections['gapless_successors'].tolist()}
+
+    def state_names(self):
+        return tuple(self.string(string_id) for string_id in self.sections['state_names'].tolist())
+
+    def media(self):
+        return {self.string(path): bool(is_video) for path, is_video in self.sections['media'].tolist()}
+
+
+def load_story(node_file):
+    """Loads a story through its compiled form, (re)compiling it first if the JSON changed since.
+
+    A .storyc file can also be given directly, e.g. on an installation that ships without the JSON. If the compiled
+    file can't be written, the JSON is parsed as it is.
+    """
+    if node_file.endswith(COMPILED_SUFFIX):
+        return CompiledNodes(node_file)
+    compiled_file = compiled_path(node_file)
+    if not is_fresh(node_file, compiled_file):
+        try:
+            compile_story(node_file, compiled_file)
+        except OSError as e:
+            print(f"Could not compile {node_file}, loading it uncompiled: {e}")
+            return load_nodes(node_file)
+    return CompiledNodes(compiled_file)
@@ -0,0 +1,94 @@
+import threading
+import time
+
+from audio import AudioPlayer
+from media_cache import AudioCache
+
+PCM = b'\1\0' * 4096
+
+
+class StubBackend:
+    """Decodes instantly, except that each decode first waits for the test to let it through."""
+
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.observed = threading.Event()
+        self.resume = threading.Event()
+
+    def decode_audio(self, video_path, cancelled=lambda: False, has_audio=None):
+        self.calls.append(video_path)
+        self.started.set()
+        self.release.wait(5)
+        result = None if cancelled() else PCM
+        # The decode has made up its mind; the test may change its own before it returns
+        self.observed.set()
+        self.resume.wait(5)
+        return result
+
+
+def make_player(backend):
+    player = AudioPlayer(AudioCache(), backend)
+    # Without a mixer the player does nothing; the worker is all these tests need
+    player.available = True
+    return player
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.perf_counter() + timeout
+    while not condition() and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_cancellation_withdrawn_before_decode_notices():
+    backend = StubBackend()
+    player = make_player(backend)
+    try:
+        player.preload(['X'])
+        assert backend.started.wait(5)
+        player.preload(['C'])
+        player.preload(['X'])
+        player.request('X')
+        backend.release.set()
+        backend.resume.set()
+        assert wait_until(lambda: player.cache.contains('X'))
+        assert player.is_ready('X')
+    finally:
+        player.close()
+
+
+def test_cancellation_withdrawn_after_decode_gave_up():
+    backend = StubBackend()
+    player = make_player(backend)
+    try:
+        player.preload(['X'])
+        assert backend.started.wait(5)
+        player.preload(['C'])
+        backend.release.set()
+        assert backend.observed.wait(5)
+        # The running decode already returned None for the cancellation; wanting X again must requeue it
+        player.preload(['X'])
+        player.request('X')
+        backend.resume.set()
+        assert wait_until(lambda: player.cache.contains('X'))
+        assert backend.calls == ['X', 'X']
+    finally:
+        player.close()
+
+
+def test_cancelled_clip_no_longer_wanted_is_dropped():
+    backend = StubBackend()
+    player = make_player(backend)
+    try:
+        player.preload(['X'])
+        assert backend.started.wait(5)
+        player.preload(['C'])
+        backend.release.set()
+        backend.resume.set()
+        assert wait_until(lambda: player.cache.contains('C'))
+        assert not player.cache.contains('X')
+        assert backend.calls == ['X', 'C']
+    finally:
+        player.close()
@@ -0,0 +1,90 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from checkpoint import FORMAT_VERSION, CheckpointWriter, load_checkpoint, write_checkpoint
+from story import GameState, load_nodes, state_names
+
+NODE_FILE = 'assets/example/example_nodes.json'
+
+
+def test_write_and_load_round_trip(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    checkpoint = {'version': FORMAT_VERSION, 'node': 'home_node', 'history': ['intro_node'], 'states': {'mood': 2}}
+    write_checkpoint(checkpoint, path)
+    assert load_checkpoint(path) == checkpoint
+    assert not os.path.exists(path + '.tmp')
+
+
+def test_failed_write_keeps_previous_checkpoint(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    write_checkpoint({'version': FORMAT_VERSION, 'node': 'home_node'}, path)
+    with pytest.raises(TypeError):
+        write_checkpoint({'version': FORMAT_VERSION, 'node': object()}, path)
+    assert load_checkpoint(path)['node'] == 'home_node'
+
+
+@pytest.mark.parametrize('content', [None, '{"node": "home_node"', '{"version": 0, "node": "home_node"}', '[]'])
+def test_unusable_checkpoints_load_as_none(tmp_path, content):
+    path = tmp_path / 'checkpoint.json'
+    if content is not None:
+        path.write_text(content)
+    assert load_checkpoint(str(path)) is None
+
+
+def test_writer_keeps_newest(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    writer = CheckpointWriter(path)
+    for position in range(50):
+        writer.save({'version': FORMAT_VERSION, 'position': position})
+    writer.close()
+    assert load_checkpoint(path)['position'] == 49
+    assert 1 <= writer.writes <= 50 and writer.errors == 0
+
+
+def make_game(node_file=NODE_FILE):
+    # Only what Game.checkpoint() and Game.restore() use, without a window
+    main = pytest.importorskip('main')
+    game = main.Game.__new__(main.Game)
+    game.node_file = node_file
+    game.nodes = load_nodes(node_file)
+    game.game_state = GameState(state_names(game.nodes))
+    game.current_node = game.nodes['intro_node']
+    game.node_history = []
+    game.video_played = False
+    game.resumed = None
+    game.player = SimpleNamespace(video_path=None, position=None)
+    return game
+
+
+def test_game_checkpoint_restores_session(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    game = make_game()
+    game.current_node = game.nodes['test1_node']
+    game.node_history = ['home_node', 'example_node']
+    game.game_state.set_state('energy', 5)
+    game.game_state.set_state('mood', -1)
+    game.player = SimpleNamespace(video_path='assets/example/slip_die.mp4', position=4.25)
+    write_checkpoint(game.checkpoint(), path)
+
+    restored = make_game()
+    restored.restore(load_checkpoint(path))
+    assert restored.current_node.key == 'test1_node'
+    assert restored.node_history == ['home_node', 'example_node']
+    assert dict(restored.game_state.states) == dict(game.game_state.states)
+    assert restored.resumed['position'] == 4.25
+    assert not restored.resumed['video_played']
+
+
+def test_checkpoint_of_another_story_is_ignored(tmp_path):
+    game = make_game()
+    game.current_node = game.nodes['home_node']
+    checkpoint = json.loads(json.dumps(game.checkpoint()))
+    checkpoint['story'] = 'other.json'
+
+    restored = make_game()
+    restored.restore(checkpoint)
+    assert restored.current_node.key == 'intro_node'
+    assert restored.resumed is None
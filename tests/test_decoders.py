@@ -0,0 +1,53 @@
+import pytest
+
+from decoders import AUDIO_CHANNELS, AUDIO_FREQUENCY, MoviepyBackend
+
+CLIP = 'assets/example/intro.mp4'
+
+
+class FakeIndex:
+    def __init__(self, entries):
+        self.entries = entries
+
+    def get(self, path):
+        return self.entries.get(path)
+
+
+def test_moviepy_decodes_audio():
+    pytest.importorskip('moviepy')
+    pcm = MoviepyBackend().decode_audio(CLIP, has_audio=True)
+    duration = MoviepyBackend().probe(CLIP)['duration']
+    # Interleaved 16 bit samples for the whole clip, to within a chunk's rounding
+    assert len(pcm) % (2 * AUDIO_CHANNELS) == 0
+    assert abs(len(pcm) / (2 * AUDIO_CHANNELS * AUDIO_FREQUENCY) - duration) < 0.1
+    assert pcm.strip(b'\0')
+
+
+def test_moviepy_audio_decode_can_be_cancelled():
+    pytest.importorskip('moviepy')
+    assert MoviepyBackend().decode_audio(CLIP, cancelled=lambda: True, has_audio=True) is None
+
+
+def test_indexed_moviepy_clip_matches_probed_clip():
+    pytest.importorskip('moviepy')
+    backend = MoviepyBackend()
+    probed = backend.probe(CLIP)
+    plain = backend.open(CLIP, (64, 36))
+    indexed = MoviepyBackend(FakeIndex({CLIP: probed})).open(CLIP, (64, 36))
+    try:
+        assert (indexed.fps, indexed.size, indexed.duration) == (plain.fps, plain.size, probed['duration'])
+        first, second = next(indexed.iter_frames()), next(plain.iter_frames())
+        assert first.shape == second.shape == (36, 64, 3)
+        assert (first == second).all()
+    finally:
+        plain.close()
+        indexed.close()
+
+
+def test_unindexed_moviepy_clip_is_probed():
+    pytest.importorskip('moviepy')
+    clip = MoviepyBackend(FakeIndex({})).open(CLIP, (64, 36), start=1.0)
+    try:
+        assert clip.size == (64, 36) and clip.duration > 0
+    finally:
+        clip.close()
@@ -0,0 +1,103 @@
+import numpy as np
+
+from media_cache import ClipFrameCache, MemoryBudget
+
+
+class FakeCache:
+    """Entries of a fixed size per key, in the shape MemoryBudget expects of a cache."""
+
+    def __init__(self, entries, max_bytes=None):
+        # key -> (media_path, nbytes, last_used)
+        self.items = dict(entries)
+        self.evicted = []
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+
+    @property
+    def bytes(self):
+        return sum(nbytes for _, nbytes, _ in self.items.values())
+
+    def entries(self):
+        return [(key, media_path, nbytes, last_used) for key, (media_path, nbytes, last_used) in self.items.items()]
+
+    def evict(self, key):
+        del self.items[key]
+        self.evicted.append(key)
+
+
+def frames(count, nbytes=100):
+    return [(index / 30, np.zeros(nbytes, dtype=np.uint8)) for index in range(count)]
+
+
+def test_history_goes_before_prefetch_and_current_is_kept():
+    budget = MemoryBudget(250)
+    images = budget.register('images', FakeCache({'old': ('a.jpg', 100, 1.0), 'now': ('c.jpg', 100, 0.5)}))
+    clips = budget.register('clips', FakeCache({'next': ('b.mp4', 100, 0.0), 'older': ('z.mp4', 100, 2.0)}))
+    budget.set_priorities(current=['c.jpg'], prefetch=['b.mp4'])
+
+    # 400 bytes against 250: the two history entries, least recently used first, are enough
+    assert budget.enforce() == 200
+    assert images.evicted == ['old'] and clips.evicted == ['older']
+    assert budget.bytes == 200 and budget.evictions == 2
+
+
+def test_prefetch_is_evicted_once_history_is_gone():
+    budget = MemoryBudget(150)
+    images = budget.register('images', FakeCache({'old': ('a.jpg', 100, 1.0), 'now': ('c.jpg', 100, 0.0)}))
+    clips = budget.register('clips', FakeCache({'next': ('b.mp4', 100, 2.0)}))
+    budget.set_priorities(current=['c.jpg'], prefetch=['b.mp4'])
+
+    assert budget.enforce() == 200
+    assert images.evicted == ['old'] and clips.evicted == ['next']
+    assert budget.bytes == 100
+
+
+def test_current_media_is_never_evicted():
+    budget = MemoryBudget(50)
+    cache = budget.register('images', FakeCache({'now': ('c.jpg', 100, 0.0), 'poster': ('c.png', 100, 1.0)}))
+    budget.set_priorities(current=['c.jpg', 'c.png'])
+    assert budget.enforce() == 0
+    assert cache.evicted == [] and budget.bytes == 200
+
+
+def test_nothing_is_evicted_within_budget():
+    budget = MemoryBudget(300)
+    cache = budget.register('images', FakeCache({'old': ('a.jpg', 100, 0.0)}))
+    assert budget.enforce() == 0
+    assert cache.evicted == []
+
+
+def test_register_caps_caches_at_the_budget():
+    budget = MemoryBudget(1000)
+    assert budget.register('large', FakeCache({}, max_bytes=5000)).max_bytes == 1000
+    assert budget.register('small', FakeCache({}, max_bytes=200)).max_bytes == 200
+    # Caches without their own limit (the player, the prefetcher) are left alone
+    assert not hasattr(budget.register('playback', FakeCache({})), 'max_bytes')
+
+
+def test_clip_cache_refuses_clips_larger_than_the_cache():
+    cache = ClipFrameCache(max_bytes=1000)
+    cache.store('a.mp4', (4, 4), frames(5))
+    cache.store('huge.mp4', (4, 4), frames(11))
+    assert cache.contains('a.mp4', (4, 4))
+    assert not cache.contains('huge.mp4', (4, 4))
+    assert cache.bytes == 500 and cache.evictions == 0
+
+
+def test_clip_cache_capped_by_budget_refuses_what_used_to_fit():
+    budget = MemoryBudget(600)
+    cache = budget.register('clip_frames', ClipFrameCache(max_bytes=1000))
+    cache.store('a.mp4', (4, 4), frames(8))
+    assert not cache.contains('a.mp4', (4, 4))
+    assert cache.bytes == 0
+
+
+def test_clip_cache_evicts_least_recently_used():
+    cache = ClipFrameCache(max_bytes=1000)
+    cache.store('a.mp4', (4, 4), frames(4))
+    cache.store('b.mp4', (4, 4), frames(4))
+    assert cache.get('a.mp4', (4, 4)) is not None
+    cache.store('c.mp4', (4, 4), frames(4))
+    assert cache.contains('a.mp4', (4, 4)) and cache.contains('c.mp4', (4, 4))
+    assert not cache.contains('b.mp4', (4, 4))
+    assert cache.bytes == 800 and cache.evictions == 1
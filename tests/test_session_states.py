@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from story import (GameState, SessionStates, build_trigger_index, enter_node, is_choice_available, load_nodes,
+                   state_names)
+
+STORIES = ['nodes.json', 'assets/example/example_nodes.json']
+SESSIONS = 200
+
+
+def random_states(nodes, seed):
+    names = state_names(nodes)
+    rng = np.random.default_rng(seed)
+    # A narrow range, so conditions go both ways and triggers on small values fire
+    return SessionStates.from_rows(rng.integers(-3, 12, size=(SESSIONS, len(names))), names)
+
+
+@pytest.mark.parametrize('node_file', STORIES)
+def test_choice_masks_match_is_choice_available(node_file):
+    nodes = load_nodes(node_file)
+    session_states = random_states(nodes, 1)
+    for node in nodes.values():
+        masks = session_states.choice_masks(node)
+        for index in range(len(session_states)):
+            states = session_states.row(index).states
+            for choice_text in node.choices:
+                assert masks[choice_text][index] == is_choice_available(node, choice_text, states)
+
+
+@pytest.mark.parametrize('node_file', STORIES)
+def test_batched_enter_matches_enter_node(node_file):
+    nodes = load_nodes(node_file)
+    trigger_index = build_trigger_index(nodes)
+    for seed, node_key in enumerate(nodes):
+        session_states = random_states(nodes, seed)
+        before = session_states.values.copy()
+        entered = session_states.enter(nodes, trigger_index, node_key)
+        for index in range(len(session_states)):
+            game_state = GameState(session_states.names)
+            game_state.session_states.values[0] = before[index]
+            assert enter_node(game_state, nodes, trigger_index, node_key) == entered[index]
+            assert (game_state.session_states.values[0] == session_states.values[index]).all()
+
+
+def test_enter_only_touches_selected_sessions():
+    nodes = load_nodes('assets/example/example_nodes.json')
+    session_states = random_states(nodes, 7)
+    before = session_states.values.copy()
+    selected = np.arange(SESSIONS) % 2 == 0
+    session_states.enter(nodes, build_trigger_index(nodes), 'example_node', selected)
+    assert (session_states.values[~selected] == before[~selected]).all()
+    assert (session_states.values[selected] != before[selected]).any()
@@ -0,0 +1,33 @@
+import json
+
+from simulate import simulate
+
+STORY = {
+    'intro_node': {'media_path': 'intro.mp4', 'choices': {'Go': 'home_node'}, 'is_video': True},
+    'home_node': {'media_path': 'home.jpg', 'is_video': False,
+                  'choices': {'Drink': 'bar_node', 'Missing': 'nowhere_node', 'Loop': 'loop_a_node',
+                              'Locked': 'locked_node'},
+                  'conditions': {'Locked': ['energy', '>', 10]}},
+    'bar_node': {'media_path': 'bar.mp4', 'choices': {'Home': 'home_node'}, 'is_video': True,
+                 'state_actions': {'increase': {'alcohol': 1}}},
+    'drunk_node': {'media_path': 'drunk.mp4', 'choices': {}, 'is_video': True, 'instant_trigger': {'alcohol': 2}},
+    'loop_a_node': {'media_path': 'a.mp4', 'choices': {'Next': 'loop_b_node'}, 'is_video': True},
+    'loop_b_node': {'media_path': 'b.mp4', 'choices': {'Next': 'loop_a_node'}, 'is_video': True},
+    'locked_node': {'media_path': 'locked.jpg', 'choices': {'Home': 'home_node'}, 'is_video': False},
+    'orphan_node': {'media_path': 'orphan.jpg', 'choices': {}, 'is_video': False},
+}
+
+
+def test_simulate_reports_graph_problems(tmp_path):
+    node_file = tmp_path / 'nodes.json'
+    node_file.write_text(json.dumps(STORY))
+    report = simulate(str(node_file))
+
+    assert report['complete']
+    assert report['unreachable_nodes'] == ['locked_node', 'orphan_node']
+    assert report['broken_links'] == [{'node': 'home_node', 'choice': 'Missing', 'target': 'nowhere_node'}]
+    # The second drink jumps to drunk_node, which has nowhere to go
+    assert report['trigger_firings'] == [{'entering': 'bar_node', 'jumped_to': 'drunk_node', 'count': 1}]
+    assert report['endings'] == ['drunk_node']
+    assert report['autoplay_loops'] == [['loop_a_node', 'loop_b_node']]
+    assert report['trigger_loops'] == []
@@ -0,0 +1,53 @@
+from story import GameState, Node, build_trigger_index, enter_node, is_choice_available
+
+
+def make_nodes():
+    return {
+        'start': Node('start.mp4', {'Go': 'calm'}, key='start'),
+        'calm': Node('calm.mp4', {'Back': 'start'}, state_actions={'increase': {'mood': 1}}, key='calm'),
+        'tired': Node('tired.mp4', {'Back': 'start'}, state_actions={'decrease': {'energy': 2}}, key='tired'),
+        'party': Node('party.mp4', {'Back': 'start'},
+                      state_actions={'set': {'energy': 5}, 'increase': {'alcohol': 3}}, key='party'),
+        'exhausted': Node('exhausted.mp4', {}, instant_trigger={'energy': -2}, key='exhausted'),
+        'idle': Node('idle.mp4', {}, instant_trigger={'energy': 0}, key='idle'),
+        'drunk': Node('drunk.mp4', {}, instant_trigger={'alcohol': 3}, key='drunk'),
+        'rested': Node('rested.mp4', {}, instant_trigger={'energy': 5}, key='rested'),
+    }
+
+
+def test_trigger_fires_for_a_state_the_node_changed():
+    nodes = make_nodes()
+    game_state = GameState()
+    assert enter_node(game_state, nodes, build_trigger_index(nodes), 'tired') == 'exhausted'
+    assert game_state.get_state('energy') == -2
+
+
+def test_trigger_ignores_states_the_node_did_not_change():
+    # energy is 0 and 'idle' triggers on energy 0, but entering 'calm' only changes mood
+    nodes = make_nodes()
+    game_state = GameState()
+    assert enter_node(game_state, nodes, build_trigger_index(nodes), 'calm') == 'calm'
+    assert game_state.get_state('mood') == 1
+
+
+def test_later_changed_state_wins():
+    # 'party' sets energy (triggers 'rested') before increasing alcohol (triggers 'drunk')
+    nodes = make_nodes()
+    assert enter_node(GameState(), nodes, build_trigger_index(nodes), 'party') == 'drunk'
+
+
+def test_first_trigger_in_file_wins():
+    nodes = make_nodes()
+    nodes['also_idle'] = Node('also_idle.mp4', {}, instant_trigger={'energy': 0}, key='also_idle')
+    assert build_trigger_index(nodes)[('energy', 0)] == 'idle'
+
+
+def test_choice_conditions():
+    node = Node('home.jpg', {'Sleep': 'a', 'Party': 'b', 'Leave': 'c'}, is_video=False,
+                conditions={'Sleep': ['energy', '<', 3], 'Party': ['energy', '>', 3], 'Leave': ['ignored']})
+    game_state = GameState()
+    game_state.set_state('energy', 5)
+    assert not is_choice_available(node, 'Sleep', game_state.states)
+    assert is_choice_available(node, 'Party', game_state.states)
+    # Conditions that aren't [state, operator, value] never hide their choice
+    assert is_choice_available(node, 'Leave', game_state.states)
@@ -0,0 +1,63 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from story import build_trigger_index, find_gapless_successors, load_nodes, state_names, story_media
+from story_store import CompiledNodes, compile_story, compiled_path, is_fresh, load_story
+
+STORIES = ['nodes.json', 'assets/example/example_nodes.json']
+NODE_FIELDS = ['key', 'media_path', 'choices', 'conditions', 'is_video', 'state_actions', 'instant_trigger']
+
+
+def plain(nodes):
+    # Story indexes from the JSON, as story.py computes them without a compiled file
+    return {'trigger_index': build_trigger_index(nodes), 'gapless_successors': find_gapless_successors(nodes),
+            'state_names': state_names(nodes), 'media': story_media(nodes)}
+
+
+@pytest.mark.parametrize('node_file', STORIES)
+def test_compiled_nodes_match_json(node_file, tmp_path):
+    expected = load_nodes(node_file)
+    compiled = CompiledNodes(compile_story(node_file, str(tmp_path / 'story.storyc')))
+
+    assert list(compiled) == list(expected)
+    assert len(compiled) == len(expected)
+    for node_key, node in expected.items():
+        compiled_node = compiled[node_key]
+        for field in NODE_FIELDS:
+            assert getattr(compiled_node, field) == getattr(node, field), (node_key, field)
+        assert list(compiled_node.choice_conditions) == list(node.choice_conditions)
+    assert 'no_such_node' not in compiled
+    assert compiled.get('no_such_node') is None
+
+    assert plain(compiled) == plain(expected)
+
+
+def test_recompiles_when_json_changes(tmp_path):
+    node_file = str(tmp_path / 'nodes.json')
+    shutil.copy('assets/example/example_nodes.json', node_file)
+    assert not is_fresh(node_file, compiled_path(node_file))
+    assert 'home_node' in load_story(node_file)
+    assert is_fresh(node_file, compiled_path(node_file))
+
+    with open(node_file) as file:
+        story = json.load(file)
+    story['home_node']['choices']['Sleep'] = 'intro_node'
+    with open(node_file, 'w') as file:
+        json.dump(story, file)
+    assert not is_fresh(node_file, compiled_path(node_file))
+    assert load_story(node_file)['home_node'].choices['Sleep'] == 'intro_node'
+    assert is_fresh(node_file, compiled_path(node_file))
+
+    # Same size, only the modification time differs
+    stat = os.stat(node_file)
+    os.utime(node_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert not is_fresh(node_file, compiled_path(node_file))
+
+
+def test_loads_compiled_file_without_json(tmp_path):
+    compiled_file = compile_story('assets/example/example_nodes.json', str(tmp_path / 'story.storyc'))
+    nodes = load_story(compiled_file)
+    assert nodes['intro_node'].media_path == 'assets/example/intro.mp4'
@@ -0,0 +1,22 @@
+import os
+
+
+def file_signature(path):
+    # (mtime in ns, size): what the media index, baked stores and compiled stories check their sources against
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def closest_size(sizes, size):
+    # Exact match, else the smallest size covering `size`, else the largest
+    width, height = size
+    larger = [candidate for candidate in sizes if candidate[0] >= width and candidate[1] >= height]
+    if larger:
+        return min(larger, key=lambda candidate: candidate[0] * candidate[1])
+    return max(sizes, key=lambda candidate: candidate[0] * candidate[1])
+
+
+def parse_size(text):
+    # 'WIDTHxHEIGHT' from the command line
+    width, height = text.lower().split('x')
+    return int(width), int(height)